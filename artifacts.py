@@ -0,0 +1,104 @@
+import hashlib, json, os, shutil, tempfile, threading, time
+
+# Subir este número invalida todos los artefactos guardados con un formato anterior
+ARTIFACT_VERSION = 3
+
+
+def content_hash(data):
+    encoded = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def write_json_atomic(path, data, indent=None):
+    # Temporal con nombre único: dos procesos que escriben el mismo archivo no se pisan el .tmp
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp",
+                                    dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class ArtifactStore:
+    # Salida de cada etapa en <root>/<run_key>/<etapa>-<hash>.json, indexada por manifest.json
+    def __init__(self, root, run_key):
+        self.root = root
+        self.run_key = run_key
+        self.path = os.path.join(root, run_key)
+        self.published_path = os.path.join(self.path, "published")
+        self.manifest_path = os.path.join(self.path, "manifest.json")
+        self.lock = threading.Lock()
+        os.makedirs(self.published_path, exist_ok=True)
+        self.manifest = self.read_manifest()
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+        if manifest.get("version") != ARTIFACT_VERSION:
+            manifest = {"version": ARTIFACT_VERSION, "stages": {}}
+        return manifest
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.published_path, exist_ok=True)
+        self.manifest = {"version": ARTIFACT_VERSION, "stages": {}}
+
+    def save(self, stage, data, input_hash=""):
+        digest = content_hash(data)
+        file_name = f"{stage}-{digest[:16]}.json"
+        write_json_atomic(os.path.join(self.path, file_name), data)
+        with self.lock:
+            previous = self.manifest["stages"].get(stage)
+            self.manifest["stages"][stage] = {
+                "file": file_name,
+                "hash": digest,
+                "input_hash": input_hash,
+                "created_at": time.time(),
+            }
+            write_json_atomic(self.manifest_path, self.manifest)
+        if previous and previous["file"] != file_name:
+            try:
+                os.remove(os.path.join(self.path, previous["file"]))
+            except FileNotFoundError:
+                pass
+        return digest
+
+    def load(self, stage, input_hash=""):
+        # Solo es válido si la etapa anterior produjo exactamente la misma entrada
+        entry = self.manifest["stages"].get(stage)
+        if not entry or entry["input_hash"] != input_hash:
+            return None, None
+        try:
+            with open(os.path.join(self.path, entry["file"]), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+        if content_hash(data) != entry["hash"]:
+            return None, None
+        return data, entry["hash"]
+
+    def mark_published(self, unidad_id, result):
+        # Un archivo por unidad: varios procesos pueden marcar unidades sin compartir el manifest
+        write_json_atomic(os.path.join(self.published_path, f"{unidad_id}.json"), result)
+
+    def published(self):
+        results = {}
+        for file_name in os.listdir(self.published_path):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.published_path, file_name), "r", encoding="utf-8") as f:
+                    result = json.load(f)
+            except json.JSONDecodeError:
+                continue
+            results[result["unidad_id"]] = result
+        return results
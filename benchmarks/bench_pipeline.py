@@ -0,0 +1,107 @@
+# Benchmark de extremo a extremo contra los servidores locales de fake_apis.py
+# Uso: python benchmarks/bench_pipeline.py --entries 5000 --products 50000 --units 200
+import os, sys, io, json, time, argparse, tracemalloc
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import emails
+from http_client import TokenBucket
+from instrumentation import setup_logging
+from fake_apis import FakeApiProcess
+
+
+def register_units(count):
+    units = [(unit.hospital, unit.unidad_id) for unit in emails.unit_registry]
+    for i in range(len(units), count):
+        hospital_name = f"H. Sintético {i + 1}"
+        unidad_id = str(1000 + i)
+        emails.add_unit(hospital_name, unidad_id, str(63120230000 + i), f"cmsint{i + 1}")
+        units.append((hospital_name, unidad_id))
+    return units[:count]
+
+
+def run_stage(name, server, func, verbose=False):
+    before = server.stats()
+    output = sys.stdout if verbose else io.StringIO()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    after = server.stats()
+
+    requests_by_api = {api: after[api]["requests"] - before[api]["requests"] for api in after}
+    bytes_by_api = {
+        api: (after[api]["bytes_in"] + after[api]["bytes_out"]) - (before[api]["bytes_in"] + before[api]["bytes_out"])
+        for api in after
+    }
+    report = {
+        "stage": name,
+        "wall_time_s": round(elapsed, 3),
+        "requests": {api: count for api, count in requests_by_api.items() if count},
+        "bytes": {api: count for api, count in bytes_by_api.items() if count},
+        "peak_memory_mb": round(peak / (1024 * 1024), 2),
+    }
+    return result, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por etapa del pipeline de correos.")
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--units", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0,
+                        help="Latencia simulada por petición en los servidores locales")
+    parser.add_argument("--respect-rate-limits", action="store_true",
+                        help="Conserva los límites de peticiones por segundo de producción")
+    parser.add_argument("--json", help="Escribe el reporte en este archivo")
+    parser.add_argument("--verbose", action="store_true", help="Muestra la salida del script")
+    args = parser.parse_args()
+
+    setup_logging("INFO" if args.verbose else "WARNING")
+    units = register_units(args.units)
+    server = FakeApiProcess(units, entries=args.entries, products=args.products, latency_ms=args.latency_ms)
+    emails.configure_dry_run(server.base_url)
+    if not args.respect_rate_limits:
+        emails.notion_limiter = TokenBucket(1e9)
+        emails.eloqua_limiter = TokenBucket(1e9)
+
+    print(f"Carga: {args.entries} entradas, {args.products} productos, {len(units)} unidades")
+    reports = []
+    try:
+        hospital_product_map, report = run_stage(
+            "build_hospital_product_map", server, emails.build_hospital_product_map, args.verbose)
+        reports.append(report)
+        matched, report = run_stage(
+            "match_and_store_products", server, lambda: emails.match_and_store_products(hospital_product_map),
+            args.verbose)
+        reports.append(report)
+        rendered, report = run_stage(
+            "render_emails", server, lambda: emails.render_emails(matched), args.verbose)
+        reports.append(report)
+        results, report = run_stage(
+            "send_email_to_eloqua", server, lambda: emails.publish_emails(rendered), args.verbose)
+        report["emails"] = len(results)
+        reports.append(report)
+    finally:
+        server.stop()
+
+    print(f"{'etapa':<28} {'tiempo (s)':>10} {'peticiones':>11} {'MB pico':>8}")
+    for report in reports:
+        print(f"{report['stage']:<28} {report['wall_time_s']:>10.3f} "
+              f"{sum(report['requests'].values()):>11} {report['peak_memory_mb']:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "workload": {"entries": args.entries, "products": args.products, "units": len(units),
+                             "latency_ms": args.latency_ms},
+                "stages": reports,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# Micro-benchmark: render actual (plantilla compilada) contra el render original
+# Uso: python benchmarks/bench_render.py --units 200 --variants 3
+import os, sys, random, argparse, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_renderer import (
+    EmailRenderer, BANNER_GIFS, ORIGINAL_BANNER_URL, TEMPLATE_PATH, get_end_of_month_date
+)
+
+
+# --- Render original, copiado de emails.py antes del motor compilado ---
+
+def legacy_load_email_template():
+    with open(TEMPLATE_PATH, "r", encoding="utf-8") as f:
+        return f.read()
+
+def legacy_generate_email_html(products):
+    html = """
+    <style>
+    @media only screen and (max-width: 600px) {
+        .product-column {
+            display: inline-block !important;
+            width: 50% !important;
+            max-width: 50% !important;
+            box-sizing: border-box;
+        }
+    }
+    </style>
+    <!--[if mso]>
+    <style type="text/css">
+        .fallback-table {width: 100% !important;}
+    </style>
+    <![endif]-->
+    <table role="presentation" cellpadding="0" cellspacing="0" border="0" align="center" style="border-collapse: collapse; width:100%; max-width:600px; margin:0 auto;">
+    """
+
+    total = len(products)
+    per_row = 3
+
+    for i in range(0, total, per_row):
+        chunk = products[i:i + per_row]
+        num_items = len(chunk)
+
+        spacer_td = ''
+        if num_items == 1:
+            spacer_td = '<td width="33%"></td>'
+        elif num_items == 2:
+            spacer_td = '<td width="16.5%"></td>'
+
+        html += "<tr>"
+
+        if spacer_td:
+            html += spacer_td
+
+        for product in chunk:
+            on_sale = product.get("on_sale", False)
+            button_text = "En Oferta" if on_sale else "Ver producto"
+            button_color = "#EC8F4F" if on_sale else "#6D247A"
+            button_border = "#EC8F4F" if on_sale else "#6D247A"
+
+            html += f"""
+            <td class="product-column" align="center" valign="top" style="padding: 10px; vertical-align: top; width: 290px; max-width: 33.33%;">
+                <table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse; background-color: white; height: 400px; table-layout: fixed;">
+                    <tr>
+                        <td align="center" style="height: 180px;">
+                            <img src="{product['image']}" alt="{product['name']}" width="180px" style="display: block; max-width: 100%; height: auto;" />
+                        </td>
+                    </tr>
+                    <tr>
+                        <td align="center" style="font-family: 'Satoshi', Arial, sans-serif; font-size: 22px; line-height: 14px; color: #636A6B; height: 80px; vertical-align: middle;">
+                            <div style="display: -webkit-box; -webkit-line-clamp: 3; -webkit-box-orient: vertical; overflow: hidden; text-overflow: ellipsis; max-height: 100px; line-height: 22px; margin: 0 auto;">
+                                {product['name']}
+                            </div>
+                        </td>
+                    </tr>
+                    <tr>
+                        <td align="center" style="font-family: 'Satoshi', Arial, sans-serif; font-size: 14px; font-weight: bold; color: #6D247A; height: 50px; vertical-align: bottom;">
+                            ${product['price']}
+                        </td>
+                    </tr>
+                    <tr>
+                        <td align="center" style="padding: 10px 0; vertical-align: top;">
+                            <a href="{product['url']}" style="
+                                display: inline-block;
+                                padding: 10px 26px;
+                                text-decoration: none;
+                                font-size: 18px;
+                                border: 2px solid {button_border};
+                                border-radius: 24px;
+                                color: white;
+                                background-color: {button_color};
+                                font-family: 'Satoshi', Arial, sans-serif;
+                            ">{button_text}</a>
+                        </td>
+                    </tr>
+                </table>
+            </td>
+            """
+
+        if spacer_td:
+            html += spacer_td
+
+        html += "</tr>"
+
+    html += "</table>"
+    return html
+
+
+def legacy_generate_legal_disclaimer():
+    end_date = get_end_of_month_date()
+    return f"""
+    <table role="presentation" cellpadding="0" cellspacing="0" border="0" align="center" width="100%" style="max-width:600px; margin:20px auto 0;">
+      <tr>
+        <td align="center" style="padding: 10px 20px;">
+          <p style="
+            margin: 0;
+            font-family: 'Satoshi', Arial, sans-serif;
+            font-size: 11px;
+            color: #636A6B;
+            line-height: 1.5;
+          ">
+            Aplican restricciones. Precios exclusivos en tienda en línea. Promociones y descuentos sujetos a cambios sin previo aviso.
+            Una vez realizado el pago, comunicarse a la sucursal para mayor información. Algunos productos requieren cita previa.<br>
+            Vigencia al {end_date}.
+          </p>
+        </td>
+      </tr>
+    </table>
+    """
+
+
+def legacy_render(products):
+    template = legacy_load_email_template()
+    template = template.replace(ORIGINAL_BANNER_URL, random.choice(BANNER_GIFS))
+    full_html = template.replace("<!-- PRODUCT_GRID_HERE -->", legacy_generate_email_html(products))
+    return full_html.replace("<!-- LEGAL_DISCLAIMER -->", legacy_generate_legal_disclaimer())
+
+
+# --- Carga sintética ---
+
+def make_products(unit, variant, count=6):
+    # Las variantes de una unidad comparten productos y solo cambian el orden
+    products = [
+        {
+            "name": f"Check up {unit}-{i} {'Mujer' if i % 2 else 'Hombre'}",
+            "price": f"{1000 + i * 250}.00",
+            "image": f"https://example.com/img/{unit}/{i}.png",
+            "url": f"https://christusmuguerza.com.mx/producto/check-up-{i}/?select_unidad={unit}&utm_campaign=correos_dinamicos_u{unit}",
+            "on_sale": i % 3 == 0,
+        }
+        for i in range(count)
+    ]
+    shift = variant % count
+    return products[shift:] + products[:shift]
+
+
+def measure(label, render, workload):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for products in workload:
+        render(products)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_email = elapsed / len(workload) * 1e6
+    print(f"{label:<10} {elapsed * 1000:9.1f} ms total  {per_email:8.1f} µs/email  peak {peak / 1024:8.1f} KiB")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el render compilado con el render original.")
+    parser.add_argument("--units", type=int, default=200)
+    parser.add_argument("--variants", type=int, default=3)
+    parser.add_argument("--products", type=int, default=6)
+    args = parser.parse_args()
+
+    workload = [
+        make_products(unit, variant, args.products)
+        for unit in range(args.units)
+        for variant in range(args.variants)
+    ]
+    renderer = EmailRenderer()
+
+    # Ambos caminos deben producir exactamente el mismo HTML
+    for products in workload[:5]:
+        random.seed(0)
+        expected = legacy_render(products)
+        random.seed(0)
+        assert renderer.render(products) == expected, "El render compilado difiere del original"
+
+    print(f"{len(workload)} correos ({args.units} unidades x {args.variants} variantes), fin de mes: {get_end_of_month_date()}")
+    legacy = measure("original", legacy_render, workload)
+    compiled = measure("compilado", renderer.render, workload)
+    print(f"Aceleración: {legacy / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
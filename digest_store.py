@@ -0,0 +1,65 @@
+import json, threading
+from contextlib import contextmanager
+from artifacts import write_json_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path):
+    # Lock entre procesos sobre un archivo auxiliar; el de datos se reemplaza en cada escritura
+    with open(path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class DigestStore:
+    # Último contenido publicado por unidad: hash sin el banner aleatorio y asset de Eloqua
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.lock = threading.Lock()
+        self.records = self.read()
+
+    def read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, unidad_id, campaign):
+        # Cada campaña mensual tiene su propio asset; uno de otro mes no se reutiliza
+        record = self.records.get(unidad_id)
+        if record and record.get("campaign") == campaign:
+            return record
+        return None
+
+    def record(self, unidad_id, campaign, digest, asset_id, name):
+        record = {
+            "campaign": campaign,
+            "digest": digest,
+            "asset_id": asset_id,
+            "name": name,
+        }
+        # Varios shards pueden compartir el archivo: se relee bajo lock para no borrar lo que grabaron los demás
+        with self.lock, file_lock(self.lock_path):
+            records = self.read()
+            records[unidad_id] = record
+            write_json_atomic(self.path, records, indent=2)
+            self.records = records
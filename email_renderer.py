@@ -0,0 +1,231 @@
+import os, random, hashlib
+from datetime import datetime, timedelta
+from string import Formatter
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "email.html")
+
+ORIGINAL_BANNER_URL = "http://img04.en25.com/EloquaImages/clients/Christus/%7B3952c7f5-400c-4741-957c-2f4b15ee8d01%7D_image_5ss.png"
+
+BANNER_GIFS = [
+    "http://img04.en25.com/EloquaImages/clients/Christus/%7B6d051d00-67ac-40cc-8952-2b0639faa692%7D_gif_muguerza_1.gif",
+    "http://img04.en25.com/EloquaImages/clients/Christus/%7B1c4ce003-491f-4fcc-89de-1f98295b015e%7D_gif_muguerza_2.gif",
+    "http://img04.en25.com/EloquaImages/clients/Christus/%7Bea96ab7a-559c-479c-9f4d-805cf90a2359%7D_gif_muguerza_3.gif",
+    "http://img04.en25.com/EloquaImages/clients/Christus/%7Bdd05ab25-a1a5-4d09-9e80-2c1dc14ec0dd%7D_gif_muguerza_4.gif"
+]
+
+# Marcadores de la plantilla que se sustituyen en cada render
+TEMPLATE_SLOTS = {
+    "banner": ORIGINAL_BANNER_URL,
+    "grid": "<!-- PRODUCT_GRID_HERE -->",
+    "legal": "<!-- LEGAL_DISCLAIMER -->",
+}
+
+GRID_HEAD = """
+    <style>
+    @media only screen and (max-width: 600px) {
+        .product-column {
+            display: inline-block !important;
+            width: 50% !important;
+            max-width: 50% !important;
+            box-sizing: border-box;
+        }
+    }
+    </style>
+    <!--[if mso]>
+    <style type="text/css">
+        .fallback-table {width: 100% !important;}
+    </style>
+    <![endif]-->
+    <table role="presentation" cellpadding="0" cellspacing="0" border="0" align="center" style="border-collapse: collapse; width:100%; max-width:600px; margin:0 auto;">
+    """
+
+GRID_TAIL = "</table>"
+
+PRODUCT_CARD = """
+            <td class="product-column" align="center" valign="top" style="padding: 10px; vertical-align: top; width: 290px; max-width: 33.33%;">
+                <table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse; background-color: white; height: 400px; table-layout: fixed;">
+                    <tr>
+                        <td align="center" style="height: 180px;">
+                            <img src="{image}" alt="{name}" width="180px" style="display: block; max-width: 100%; height: auto;" />
+                        </td>
+                    </tr>
+                    <tr>
+                        <td align="center" style="font-family: 'Satoshi', Arial, sans-serif; font-size: 22px; line-height: 14px; color: #636A6B; height: 80px; vertical-align: middle;">
+                            <div style="display: -webkit-box; -webkit-line-clamp: 3; -webkit-box-orient: vertical; overflow: hidden; text-overflow: ellipsis; max-height: 100px; line-height: 22px; margin: 0 auto;">
+                                {name}
+                            </div>
+                        </td>
+                    </tr>
+                    <tr>
+                        <td align="center" style="font-family: 'Satoshi', Arial, sans-serif; font-size: 14px; font-weight: bold; color: #6D247A; height: 50px; vertical-align: bottom;">
+                            ${price}
+                        </td>
+                    </tr>
+                    <tr>
+                        <td align="center" style="padding: 10px 0; vertical-align: top;">
+                            <a href="{url}" style="
+                                display: inline-block;
+                                padding: 10px 26px;
+                                text-decoration: none;
+                                font-size: 18px;
+                                border: 2px solid {button_border};
+                                border-radius: 24px;
+                                color: white;
+                                background-color: {button_color};
+                                font-family: 'Satoshi', Arial, sans-serif;
+                            ">{button_text}</a>
+                        </td>
+                    </tr>
+                </table>
+            </td>
+            """
+
+ROW_SPACERS = {1: '<td width="33%"></td>', 2: '<td width="16.5%"></td>'}
+
+LEGAL_DISCLAIMER = """
+    <table role="presentation" cellpadding="0" cellspacing="0" border="0" align="center" width="100%" style="max-width:600px; margin:20px auto 0;">
+      <tr>
+        <td align="center" style="padding: 10px 20px;">
+          <p style="
+            margin: 0;
+            font-family: 'Satoshi', Arial, sans-serif;
+            font-size: 11px;
+            color: #636A6B;
+            line-height: 1.5;
+          ">
+            Aplican restricciones. Precios exclusivos en tienda en línea. Promociones y descuentos sujetos a cambios sin previo aviso.
+            Una vez realizado el pago, comunicarse a la sucursal para mayor información. Algunos productos requieren cita previa.<br>
+            Vigencia al {end_date}.
+          </p>
+        </td>
+      </tr>
+    </table>
+    """
+
+
+def get_end_of_month_date():
+    today = datetime.today()
+    next_month = today.replace(day=28) + timedelta(days=4)  # Te lleva al próximo mes
+    end_of_month = next_month - timedelta(days=next_month.day)
+    return end_of_month.strftime("%d de %B de %Y")  # Ej: '30 de junio de 2025'
+
+def generate_legal_disclaimer():
+    return LEGAL_DISCLAIMER.format(end_date=get_end_of_month_date())
+
+
+def split_template(template):
+    # "a{x}b" -> ["a", ("x",), "b"]: los segmentos estáticos se crean una sola vez
+    segments = []
+    for literal, field, _, _ in Formatter().parse(template):
+        if literal:
+            segments.append(literal)
+        if field is not None:
+            segments.append((field,))
+    return segments
+
+
+PRODUCT_CARD_SEGMENTS = split_template(PRODUCT_CARD)
+
+
+def product_card_parts(name, price, image, url, on_sale):
+    # Sin cache: la URL lleva el UTM de la unidad y casi nunca se repite entre correos
+    values = {
+        "name": name,
+        "price": price,
+        "image": image,
+        "url": url,
+        "button_text": "En Oferta" if on_sale else "Ver producto",
+        "button_color": "#EC8F4F" if on_sale else "#6D247A",
+        "button_border": "#EC8F4F" if on_sale else "#6D247A",
+    }
+    return [values[segment[0]] if isinstance(segment, tuple) else segment for segment in PRODUCT_CARD_SEGMENTS]
+
+
+def render_product_grid_parts(products, per_row=3):
+    parts = [GRID_HEAD]
+    for i in range(0, len(products), per_row):
+        chunk = products[i:i + per_row]
+        spacer_td = ROW_SPACERS.get(len(chunk), "")
+        parts.append("<tr>")
+        parts.append(spacer_td)
+        for product in chunk:
+            parts.extend(product_card_parts(
+                product["name"],
+                product["price"],
+                product["image"],
+                product["url"],
+                bool(product.get("on_sale", False)),
+            ))
+        parts.append(spacer_td)
+        parts.append("</tr>")
+    parts.append(GRID_TAIL)
+    return parts
+
+
+def render_product_grid(products, per_row=3):
+    return "".join(render_product_grid_parts(products, per_row))
+
+
+class EmailTemplate:
+    # Plantilla dividida una sola vez en segmentos estáticos y slots con nombre
+    def __init__(self, html):
+        self.segments = []
+        position = 0
+        while True:
+            matches = [(html.find(marker, position), name, marker) for name, marker in TEMPLATE_SLOTS.items()]
+            matches = [match for match in matches if match[0] != -1]
+            if not matches:
+                break
+            start, name, marker = min(matches)
+            self.segments.append(html[position:start])
+            self.segments.append((name,))
+            position = start + len(marker)
+        self.segments.append(html[position:])
+
+    @classmethod
+    def load(cls, path=TEMPLATE_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(f.read())
+
+    def iter_parts(self, slots, exclude=()):
+        for segment in self.segments:
+            if isinstance(segment, tuple):
+                if segment[0] in exclude:
+                    continue
+                value = slots[segment[0]]
+                if isinstance(value, str):
+                    yield value
+                else:
+                    yield from value
+            else:
+                yield segment
+
+    def render(self, slots):
+        return "".join(self.iter_parts(slots))
+
+    def digest(self, slots, exclude=()):
+        sha = hashlib.sha256()
+        for part in self.iter_parts(slots, exclude):
+            sha.update(part.encode("utf-8"))
+        return sha.hexdigest()
+
+
+class EmailRenderer:
+    def __init__(self, template_path=TEMPLATE_PATH):
+        self.template = EmailTemplate.load(template_path)
+        # El aviso legal solo depende del mes, es constante durante la ejecución
+        self.legal_html = generate_legal_disclaimer()
+
+    def render(self, products, banner=None):
+        return self.template.render({
+            "banner": banner or random.choice(BANNER_GIFS),
+            "grid": render_product_grid_parts(products),
+            "legal": self.legal_html,
+        })
+
+    def content_digest(self, products):
+        # Hash del correo sin el banner, que cambia al azar en cada render
+        return self.template.digest({
+            "grid": render_product_grid_parts(products),
+            "legal": self.legal_html,
+        }, exclude=("banner",))
@@ -1,20 +1,63 @@
-import os, requests, threading, base64, re, json, random
-from datetime import datetime, timedelta
+import os, requests, base64, json, argparse, tempfile, logging, zlib, glob, asyncio, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import repeat, islice
+from functools import lru_cache
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from http_client import ApiClient, TokenBucket
+from notion_cache import NotionPageCache
+from image_cache import ImageCheckCache
+from email_renderer import EmailRenderer
+from html_optimizer import optimize_html
+from instrumentation import metrics, setup_logging
+from artifacts import ArtifactStore, content_hash
+from digest_store import DigestStore
+from normalization import NameNormalizer, match_key, strip_unit_prefix
+from records import RECORD_VERSION, NotionEntry, WooProduct
+from selection import SCORERS, TopKSelector
+from unit_registry import UNITS_PATH, UnitRegistry
+
+logger = logging.getLogger("emails")
 
 # Load environment variables
 load_dotenv()
+NOTION_API_URL = os.getenv("NOTION_API_URL", "https://api.notion.com/v1")
 NOTION_API_TOKEN = os.getenv("NOTION_API_TOKEN")
 DATABASE_ID = os.getenv("DATABASE_ID_FORMS")
+DATABASE_ID_PRODUCTS = os.getenv("DATABASE_ID_PRODUCTS")
 WOO_URL = os.getenv("WOO_URL")
 WOO_KEY = os.getenv("WOO_KEY")
 WOO_SECRET = os.getenv("WOO_SECRET")
+WOO_MAX_WORKERS = int(os.getenv("WOO_MAX_WORKERS", "4"))
+WOO_SNAPSHOT_PATH = os.getenv("WOO_SNAPSHOT_PATH", ".woo_snapshot.json")
+# Solo los campos que se proyectan a WooProduct, más status para filtrar
+WOO_FIELDS = "id,name,slug,price,on_sale,status,meta_data,images"
 
+ELOQUA_API_URL = os.getenv("ELOQUA_API_URL", "https://secure.p04.eloqua.com/API/REST/2.0")
 ELOQUA_COMPANY = os.getenv("ELOQUA_COMPANY")
 ELOQUA_USERNAME = os.getenv("ELOQUA_USERNAME")
 ELOQUA_PASSWORD = os.getenv("ELOQUA_PASSWORD")
 ELOQUA_FOLDER_ID = os.getenv("ELOQUA_EMAIL_FOLDER_ID")
+ELOQUA_MAX_WORKERS = int(os.getenv("ELOQUA_MAX_WORKERS", "4"))
+ELOQUA_RATE_LIMIT = float(os.getenv("ELOQUA_RATE_LIMIT", "4"))
+eloqua_limiter = TokenBucket(ELOQUA_RATE_LIMIT)
+# Cuerpos comprimidos con gzip hacia Eloqua; si el endpoint los rechaza se vuelve a enviar sin comprimir
+ELOQUA_GZIP_REQUESTS = os.getenv("ELOQUA_GZIP_REQUESTS", "0") == "1"
+eloqua_gzip = ELOQUA_GZIP_REQUESTS
+
+# Productos por correo y criterio para elegirlos (ver selection.SCORERS)
+EMAIL_MAX_PRODUCTS = 6
+PRODUCT_RANKING = os.getenv("PRODUCT_RANKING", "on_sale_requests")
+
+# Minificación del HTML antes de subirlo; EMAIL_FACTOR_STYLES además mueve estilos en línea repetidos a clases
+EMAIL_MINIFY = os.getenv("EMAIL_MINIFY", "1") == "1"
+EMAIL_FACTOR_STYLES = os.getenv("EMAIL_FACTOR_STYLES", "0") == "1"
+
+# Conexiones keep-alive por API y timeouts (conexión, lectura) en segundos
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")), float(os.getenv("HTTP_READ_TIMEOUT", "30")))
 
 headers = {
     "Authorization": f"Bearer {NOTION_API_TOKEN}",
@@ -22,481 +65,1238 @@ headers = {
     "Content-Type": "application/json"
 }
 
-hospital_to_unidad = {
-    "H. Alta Especialidad": {"unidad_id": "565", "url_id": "53120233092"},
-    "H. Conchita": {"unidad_id": "566", "url_id": "53120233093"},
-    "H. Sur": {"unidad_id": "567", "url_id": "53120233094"},
-    "H. Vidriera": {"unidad_id": "568", "url_id": "53120233095"},
-    "H. Reynosa": {"unidad_id": "569", "url_id": "53120233096"},
-    "H. Del Parque": {"unidad_id": "570", "url_id": "53120233097"},
-    "H. Saltillo": {"unidad_id": "571", "url_id": "53120233098"},
-    "H. Betania": {"unidad_id": "572", "url_id": "53120233099"},
-    "H. UPAEP": {"unidad_id": "573", "url_id": "53120233100"},
-    "H. San Nicolás": {"unidad_id": "574", "url_id": "53120233101"},
-    "H. Faro del Mayab": {"unidad_id": "575", "url_id": "53120233102"},
-    "H. Cumbres": {"unidad_id": "576", "url_id": "53120233103"},
-    "H. Altagracia": {"unidad_id": "577", "url_id": "53120233104"},
-    "C. San Pedro": {"unidad_id": "578", "url_id": "53120233105"},
-    "C. Juventud": {"unidad_id": "579", "url_id": "53120233106"},
-    "C. Irapuato": {"unidad_id": "580", "url_id": "53120233107"},
-}
-
-unidad_to_hospital = {v["unidad_id"]: k for k, v in hospital_to_unidad.items()}
-
-hospital_to_siglas = {
-    "H. Alta Especialidad": "cmae",
-    "H. Conchita": "cmc",
-    "H. Sur": "cmsur",
-    "H. Vidriera": "cmv",
-    "H. Reynosa": "cmr",
-    "H. Del Parque": "cmdp",
-    "H. Saltillo": "cms",
-    "H. Betania": "cmb",
-    "H. UPAEP": "cmupaep",
-    "H. San Nicolás": "cmsn",
-    "H. Faro del Mayab": "cmfm",
-    "H. Cumbres": "cmcu",
-    "H. Altagracia": "cmag",
-    "C. San Pedro": "cmsp",
-    "C. Juventud": "cmj",
-    "C. Irapuato": "cmi",
-}
-
-
+# Notion permite en promedio 3 peticiones por segundo por integración
+NOTION_MAX_WORKERS = int(os.getenv("NOTION_MAX_WORKERS", "3"))
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))
+notion_limiter = TokenBucket(NOTION_RATE_LIMIT)
+# En --async, si otra etapa falla, las descargas de Notion pendientes se abandonan en vez de agotarse a 3 req/s
+notion_stop = threading.Event()
+
+# Cache local de páginas de producto; NOTION_CACHE_PATH vacío lo desactiva
+NOTION_CACHE_PATH = os.getenv("NOTION_CACHE_PATH", ".notion_cache.sqlite")
+NOTION_CACHE_TTL_DAYS = float(os.getenv("NOTION_CACHE_TTL_DAYS", "30"))
+NOTION_CACHE_MAX_ENTRIES = int(os.getenv("NOTION_CACHE_MAX_ENTRIES", "50000"))
+
+# Validación de la imagen real de cada producto: HEAD concurrente y resultado en cache por IMAGE_CACHE_TTL_DAYS
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", ".image_cache.sqlite")
+IMAGE_CACHE_TTL_DAYS = float(os.getenv("IMAGE_CACHE_TTL_DAYS", "7"))
+IMAGE_CHECK_WORKERS = int(os.getenv("IMAGE_CHECK_WORKERS", "8"))
+IMAGE_MIN_BYTES = int(os.getenv("IMAGE_MIN_BYTES", "2048"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(2 * 1024 * 1024)))
+
+# Solo se piden estas propiedades del formulario; el resto no se usa
+FORM_PROPERTIES = ["Unidad de servicio", "Productos"]
+NOTION_SYNC_STATE_PATH = os.getenv("NOTION_SYNC_STATE_PATH", ".notion_sync.json")
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", ".artifacts")
+ELOQUA_DIGESTS_PATH = os.getenv("ELOQUA_DIGESTS_PATH", ".eloqua_digests.json")
+# Lotes de productos en cola entre etapas en modo --async; una cola llena frena a la etapa anterior
+ASYNC_QUEUE_SIZE = int(os.getenv("ASYNC_QUEUE_SIZE", "10"))
+ASYNC_BATCH_SIZE = 100
+# Productos guardados mientras se arma el mapa de Notion; al llenarse se deja de leer la cola y se frena el crawl
+ASYNC_WAITING_LIMIT = ASYNC_QUEUE_SIZE * ASYNC_BATCH_SIZE
+# Cada cuánto revisa el hilo del crawl si las demás etapas siguen vivas mientras espera lugar en la cola
+ASYNC_STOP_POLL_SECONDS = 0.5
+
+# Unidades, siglas, url_id y las imágenes genéricas viven en units.json; agregar una unidad no requiere tocar código
+UNITS_CONFIG_PATH = os.getenv("UNITS_CONFIG_PATH", UNITS_PATH)
+unit_registry = UnitRegistry.load(UNITS_CONFIG_PATH)
+
+# Un patrón de alias por hospital, compilado al inicio
+name_normalizer = NameNormalizer(unit_registry.hospital_names())
+
+def add_unit(hospital_name, unidad_id, url_id, siglas):
+    unit = unit_registry.add(hospital_name, unidad_id, url_id, siglas)
+    name_normalizer.alias_pattern(hospital_name)
+    return unit
+
+
+@lru_cache(maxsize=1)
 def get_eloqua_auth_header():
     auth_string = f"{ELOQUA_COMPANY}\\{ELOQUA_USERNAME}:{ELOQUA_PASSWORD}"
     b64_auth = base64.b64encode(auth_string.encode()).decode()
     return {"Authorization": f"Basic {b64_auth}", "Content-Type": "application/json"}
 
+http_clients = {}
+http_clients_lock = threading.Lock()
+
+def get_http_client(api):
+    # Se crean al primer uso para que --dry-run y los procesos hijos tomen las URLs vigentes
+    with http_clients_lock:
+        client = http_clients.get(api)
+        if client is None:
+            if api == "notion":
+                client = ApiClient("notion", NOTION_API_URL, headers=headers,
+                                   pool_size=max(HTTP_POOL_SIZE, NOTION_MAX_WORKERS), timeout=HTTP_TIMEOUT)
+            elif api == "images":
+                client = ApiClient("images", pool_size=IMAGE_CHECK_WORKERS, timeout=(3.0, 5.0), hosts=4)
+            elif api == "woo":
+                client = ApiClient("woo", WOO_URL, auth=(WOO_KEY, WOO_SECRET),
+                                   pool_size=max(HTTP_POOL_SIZE, WOO_MAX_WORKERS), timeout=HTTP_TIMEOUT)
+            else:
+                client = ApiClient("eloqua", ELOQUA_API_URL, headers=get_eloqua_auth_header(),
+                                   pool_size=max(HTTP_POOL_SIZE, ELOQUA_MAX_WORKERS), timeout=HTTP_TIMEOUT)
+            http_clients[api] = client
+        return client
+
+def reset_http_clients(close=True):
+    # close=False en procesos hijos: las conexiones heredadas del padre no se tocan
+    with http_clients_lock:
+        if close:
+            for client in http_clients.values():
+                client.close()
+        http_clients.clear()
+
 def test_eloqua_auth():
-    print("Testing Eloqua authentication...")
-    url = "https://secure.p04.eloqua.com/API/REST/2.0/assets/emails"
-    response = requests.get(url, headers=get_eloqua_auth_header())
+    logger.info("Testing Eloqua authentication...")
+    # Un solo asset y sin detalle: basta para validar las credenciales
+    response = get_http_client("eloqua").get("assets/emails", params={"count": 1, "depth": "minimal"})
     if response.status_code == 200:
-        print("✅ Eloqua authentication successful.")
+        logger.info("✅ Eloqua authentication successful.")
         return True
     else:
-        print(f"❌ Eloqua authentication failed: {response.status_code}")
-        print(response.text)
+        logger.error("❌ Eloqua authentication failed: %s", response.status_code)
+        logger.error(response.text)
         return False
 
-def get_database_entries():
-    print("Fetching Notion database entries...")
-    url = f"https://api.notion.com/v1/databases/{DATABASE_ID}/query"
+def start_eloqua_auth_probe():
+    # La verificación corre mientras se descarga Notion; se espera su resultado antes de seguir
+    executor = ThreadPoolExecutor(max_workers=1)
+    probe = executor.submit(test_eloqua_auth)
+    executor.shutdown(wait=False)
+    return probe
+
+def get_month_start():
+    return datetime.now().astimezone().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def parse_notion_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def get_form_property_ids():
+    response = get_http_client("notion").get(f"databases/{DATABASE_ID}", limiter=notion_limiter)
+    if response.status_code != 200:
+        logger.warning("⚠️ No se pudo leer el esquema del formulario, se piden todas las propiedades")
+        return []
+    props = response.json().get("properties", {})
+    return [props[name]["id"] for name in FORM_PROPERTIES if name in props]
+
+def query_database(query_filter, property_ids):
+    path = f"databases/{DATABASE_ID}/query"
+    params = [("filter_properties", property_id) for property_id in property_ids]
     entries = []
     next_cursor = None
 
     while True:
-        payload = {"page_size": 100}
+        if notion_stop.is_set():
+            return entries, False
+        payload = {"page_size": 100, "filter": query_filter}
         if next_cursor:
             payload["start_cursor"] = next_cursor
 
-        response = requests.post(url, headers=headers, json=payload)
+        response = get_http_client("notion").post(path, limiter=notion_limiter, params=params, json=payload)
         data = response.json()
         if response.status_code != 200:
-            print("Error fetching database entries:", data)
-            break
+            logger.error("Error fetching database entries: %s", data)
+            return entries, False
 
-        entries.extend(data["results"])
+        entries.extend(NotionEntry.from_api(result) for result in data["results"])
         if not data.get("has_more"):
-            break
+            return entries, True
         next_cursor = data.get("next_cursor")
 
-    print(f"✅ Retrieved {len(entries)} entries from Notion")
+def load_sync_state():
+    try:
+        with open(NOTION_SYNC_STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_sync_state(state):
+    tmp_path = f"{NOTION_SYNC_STATE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, NOTION_SYNC_STATE_PATH)
+
+def get_database_entries(incremental=False):
+    logger.info("Fetching Notion database entries...")
+    month_start = get_month_start()
+    month_key = month_start.strftime("%Y-%m")
+    query_filter = {"timestamp": "created_time", "created_time": {"on_or_after": month_start.isoformat()}}
+    property_ids = get_form_property_ids()
+
+    # En modo incremental solo se descargan las entradas editadas desde la última marca
+    state = load_sync_state() if incremental else {}
+    stored = {}
+    if state.get("month") == month_key and state.get("high_water_mark") and state.get("records") == RECORD_VERSION:
+        stored = {row[0]: NotionEntry.from_row(row) for row in state.get("entries", [])}
+        query_filter = {"and": [
+            query_filter,
+            {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": state["high_water_mark"]}}
+        ]}
+        logger.info("🔁 Sincronización incremental desde %s", state["high_water_mark"])
+
+    changed, complete = query_database(query_filter, property_ids)
+    for entry in changed:
+        stored[entry.id] = entry
+    entries = list(stored.values())
+
+    if incremental and complete:
+        edit_times = [entry.last_edited_time for entry in entries if entry.last_edited_time]
+        save_sync_state({
+            "month": month_key,
+            "high_water_mark": max(edit_times, default=state.get("high_water_mark")),
+            "records": RECORD_VERSION,
+            "entries": [entry.to_row() for entry in entries]
+        })
+
+    logger.info("✅ Retrieved %d entries from Notion (%d downloaded)", len(entries), len(changed),
+                extra={"entries": len(entries), "downloaded": len(changed)})
+    metrics.add_items("notion_entries", len(entries))
     if entries:
-        print("🔍 Propiedades del primer resultado:")
-        print(json.dumps(entries[0]["properties"], indent=2, ensure_ascii=False))
+        logger.debug("🔍 Primer resultado: %r", entries[0])
     return entries
 
 
-def get_product_titles_and_units(product_relations):
+def parse_product_page(page):
+    props = page.get("properties", {})
+    title = next((t["plain_text"] for p in props.values() if p["type"] == "title" for t in p.get("title", [])), None)
+    unidad = (props.get("Unidad", {}).get("select") or {}).get("name")
+    return title, unidad, page.get("last_edited_time")
+
+def fetch_notion_page(page_id):
+    if notion_stop.is_set():
+        return None
+    res = get_http_client("notion").get(f"pages/{page_id}", limiter=notion_limiter)
+    if res.status_code != 200:
+        return None
+    return parse_product_page(res.json())
+
+def open_product_cache():
+    if not NOTION_CACHE_PATH:
+        return None
+    return NotionPageCache(NOTION_CACHE_PATH, NOTION_CACHE_TTL_DAYS * 86400, NOTION_CACHE_MAX_ENTRIES)
+
+def refresh_changed_product_pages(cache):
+    # Consulta solo las páginas editadas desde la última versión en cache
+    since = cache.newest_edit_time()
+    if not DATABASE_ID_PRODUCTS or not since:
+        return 0
+
+    path = f"databases/{DATABASE_ID_PRODUCTS}/query"
+    payload = {
+        "page_size": 100,
+        "filter": {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": since}}
+    }
+    refreshed = 0
+    while not notion_stop.is_set():
+        response = get_http_client("notion").post(path, limiter=notion_limiter, json=payload)
+        if response.status_code != 200:
+            logger.warning("⚠️ No se pudieron validar las páginas en cache: %s", response.status_code)
+            break
+        data = response.json()
+        for page in data["results"]:
+            cache.put(page["id"], *parse_product_page(page))
+            refreshed += 1
+        if not data.get("has_more"):
+            break
+        payload["start_cursor"] = data.get("next_cursor")
+    cache.commit()
+    return refreshed
+
+def resolve_product_pages(page_ids):
+    unique_ids = list(dict.fromkeys(page_id for page_id in page_ids if page_id))
+    logger.info("📄 Resolviendo %d páginas de producto únicas en Notion...", len(unique_ids))
+    resolved = {}
+    cache = open_product_cache()
+    pending = unique_ids
+
+    if cache:
+        refreshed = refresh_changed_product_pages(cache)
+        if refreshed:
+            logger.info("🔄 %d páginas actualizadas en cache", refreshed)
+        pending = []
+        for page_id in unique_ids:
+            cached = cache.get(page_id)
+            if cached:
+                resolved[page_id] = cached
+            else:
+                pending.append(page_id)
+
+    metrics.add_items("notion_pages_fetched", len(pending))
+    with ThreadPoolExecutor(max_workers=NOTION_MAX_WORKERS) as pool:
+        for page_id, page in zip(pending, pool.map(fetch_notion_page, pending)):
+            if page:
+                title, unidad, last_edited_time = page
+                resolved[page_id] = (title, unidad)
+                if cache:
+                    cache.put(page_id, title, unidad, last_edited_time)
+
+    if cache:
+        evicted = cache.evict()
+        stats = cache.stats()
+        logger.info("🗄️ Cache de Notion: %d hits, %d misses, %d desalojadas", stats["hits"], stats["misses"], evicted,
+                    extra={"cache": stats})
+        metrics.add_items("notion_cache_hits", stats["hits"])
+        metrics.add_items("notion_cache_misses", stats["misses"])
+        cache.close()
+    return resolved
+
+def get_product_titles_and_units(product_ids, resolved_pages=None):
+    if resolved_pages is None:
+        resolved_pages = resolve_product_pages(product_ids)
+
     titles = []
     unidades = []
-    for item in product_relations:
-        page_id = item.get("id")
-        if not page_id:
-            continue
-
-        url = f"https://api.notion.com/v1/pages/{page_id}"
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            continue
-
-        props = res.json().get("properties", {})
-        title = next((t["plain_text"] for p in props.values() if p["type"] == "title" for t in p.get("title", [])), None)
-        unidad = props.get("Unidad", {}).get("select", {}).get("name")
+    for page_id in product_ids:
+        title, unidad = resolved_pages.get(page_id, (None, None))
         if title and unidad:
             titles.append(title)
             unidades.append(unidad)
 
     return titles, unidades
 
-def fetch_products_stream():
-    page = 1
-    while True:
-        response = requests.get(
-            WOO_URL,
-            params={
-                "per_page": 100,
-                "page": page,
-                "_fields": "id,sku,name,slug,meta_data,attributes,images,price,permalink,on_sale,status"
-            },
-            auth=(WOO_KEY, WOO_SECRET)
-        )
-        if response.status_code != 200:
-            break
-        products = response.json()
-        if not products:
-            break
-        for product in products:
+def fetch_products_page(page, params):
+    return get_http_client("woo").get(params={**params, "page": page})
+
+def fetch_product_pages(params, failed_pages=None):
+    # Las páginas que fallan se anotan en failed_pages para que quien llama sepa si el catálogo quedó completo
+    failed_pages = failed_pages if failed_pages is not None else []
+    first = fetch_products_page(1, params)
+    if first.status_code != 200:
+        logger.error("❌ Error fetching WooCommerce products: %s", first.status_code)
+        failed_pages.append(1)
+        return
+    total_pages = int(first.headers.get("X-WP-TotalPages", 1))
+    logger.info("🛒 WooCommerce: %s productos en %d páginas", first.headers.get("X-WP-Total", "?"), total_pages)
+    yield first.json()
+
+    # Ventana acotada de páginas en vuelo; se entregan en orden de página
+    with ThreadPoolExecutor(max_workers=WOO_MAX_WORKERS) as pool:
+        pending = deque()
+        next_page = 2
+        while pending or next_page <= total_pages:
+            while next_page <= total_pages and len(pending) < WOO_MAX_WORKERS * 2:
+                pending.append((next_page, pool.submit(fetch_products_page, next_page, params)))
+                next_page += 1
+            page, future = pending.popleft()
+            response = future.result()
+            if response.status_code != 200:
+                logger.warning("⚠️ Página %d de WooCommerce falló: %s", page, response.status_code)
+                failed_pages.append(page)
+                continue
+            yield response.json()
+
+def load_product_snapshot():
+    try:
+        with open(WOO_SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_product_snapshot(snapshot):
+    tmp_path = f"{WOO_SNAPSHOT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, WOO_SNAPSHOT_PATH)
+
+def fetch_products_delta():
+    snapshot = load_product_snapshot()
+    if snapshot.get("records") != RECORD_VERSION:
+        # Snapshot con otro formato de registro: se vuelve a descargar el catálogo completo
+        snapshot = {}
+    products = {product_id: WooProduct.from_row(row) for product_id, row in snapshot.get("products", {}).items()}
+    synced_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    params = {"per_page": 100, "_fields": WOO_FIELDS}
+
+    if snapshot.get("synced_at"):
+        # Se piden todos los estados para retirar productos que dejaron de estar publicados
+        params.update({"status": "any", "modified_after": snapshot["synced_at"], "dates_are_gmt": "true"})
+        logger.info("🔁 WooCommerce: cambios desde %s", snapshot["synced_at"])
+    else:
+        params["status"] = "publish"
+        products = {}
+
+    failed_pages = []
+    for page in fetch_product_pages(params, failed_pages):
+        for product in page:
             if product.get("status") == "publish":
-                yield product   
-        page += 1
+                products[str(product["id"])] = WooProduct.from_api(product)
+            else:
+                products.pop(str(product["id"]), None)
 
-def build_hospital_product_map():
-    entries = get_database_entries()
-    now = datetime.now()
+    # Con páginas faltantes no se avanza synced_at: los cambios de esas páginas se perderían para siempre
+    if failed_pages:
+        logger.warning("⚠️ Snapshot de WooCommerce sin actualizar: %d páginas fallaron", len(failed_pages))
+    else:
+        save_product_snapshot({
+            "synced_at": synced_at,
+            "records": RECORD_VERSION,
+            "products": {product_id: product.to_row() for product_id, product in products.items()}
+        })
+    yield from products.values()
+
+def fetch_products_stream(delta=False):
+    if delta:
+        yield from fetch_products_delta()
+        return
+
+    params = {"per_page": 100, "status": "publish", "_fields": WOO_FIELDS}
+    for products in fetch_product_pages(params):
+        for product in products:
+            if product.get("status") == "publish":
+                yield WooProduct.from_api(product)
+
+def get_entry_unidad_id(entry):
+    unit = unit_registry.by_name(entry.unidad)
+    return unit.unidad_id if unit else None
+
+def build_hospital_product_map(incremental=False, units=None):
+    entries = get_database_entries(incremental)
+    if units is not None:
+        # Las entradas de otras unidades no se resuelven en este shard
+        entries = [entry for entry in entries if get_entry_unidad_id(entry) in units]
+    month_start = get_month_start()
     hospital_product_map = {}
 
+    # Resuelve todas las relaciones una sola vez antes de recorrer las entradas
+    resolved_pages = resolve_product_pages(page_id for entry in entries for page_id in entry.product_ids)
+
     for entry in entries:
-        print("🔸 Revisando entrada...")
+        logger.debug("🔸 Revisando entrada %s", entry.id)
 
-        created = entry.get("created_time")
+        created = entry.created_time
         if not created:
-            print("⛔ Sin fecha de creación")
+            logger.debug("⛔ Sin fecha de creación")
             continue
 
-        created_date = datetime.fromisoformat(created)
-        
-        props = entry.get("properties", {})
-        unidad_servicio = props.get("Unidad de servicio", {}).get("select", {}).get("name")
-        productos = props.get("Productos", {}).get("relation", [])
+        created_date = parse_notion_time(created)
+        if created_date < month_start:
+            logger.debug("⛔ Entrada fuera del mes actual")
+            continue
+
+        unidad_servicio = entry.unidad
+        productos = entry.product_ids
 
-        print(f"✅ Unidad de servicio: {unidad_servicio}")
-        print(f"🔗 Productos relacionados encontrados: {len(productos)}")
+        logger.debug("✅ Unidad de servicio: %s", unidad_servicio)
+        logger.debug("🔗 Productos relacionados encontrados: %d", len(productos))
 
         if not unidad_servicio or not productos:
-            print("⛔ Faltan datos clave (unidad o productos)")
+            logger.debug("⛔ Faltan datos clave (unidad o productos)")
             continue
 
-        titles, unidades = get_product_titles_and_units(productos)
-        print(f"📦 Títulos obtenidos: {titles}")
-        print(f"🏥 Unidades asociadas: {unidades}")
+        titles, unidades = get_product_titles_and_units(productos, resolved_pages)
+        logger.debug("📦 Títulos obtenidos: %s", titles)
+        logger.debug("🏥 Unidades asociadas: %s", unidades)
 
         for title, unidad_producto in zip(titles, unidades):
-            print(f"→ Comparando '{unidad_producto}' con '{unidad_servicio}'")
+            logger.debug("→ Comparando '%s' con '%s'", unidad_producto, unidad_servicio)
             if unidad_producto == unidad_servicio:
-                cleaned_title = re.sub(r"^[^-]*-\s*", "", title)
-                hospital_data = hospital_to_unidad.get(unidad_servicio)
+                cleaned_title = strip_unit_prefix(title)
+                unit = unit_registry.by_name(unidad_servicio)
 
-                if hospital_data:
-                    unidad_id = hospital_data["unidad_id"]
+                if unit:
+                    unidad_id = unit.unidad_id
                     hospital_product_map.setdefault(unidad_id, []).append(cleaned_title)
-                    print(f"✅ Agregado: {cleaned_title} a {unidad_servicio} ({unidad_id})")
+                    logger.debug("✅ Agregado: %s a %s (%s)", cleaned_title, unidad_servicio, unidad_id)
                 else:
-                    print(f"⚠️ Unidad de servicio '{unidad_servicio}' no encontrada en el diccionario")
+                    logger.warning("⚠️ Unidad de servicio '%s' no encontrada en el diccionario", unidad_servicio)
 
-    print("✅ Mapa hospital-producto construido:")
-    print(json.dumps(hospital_product_map, indent=2, ensure_ascii=False))
+    logger.info("✅ Mapa hospital-producto construido: %d unidades, %d productos", len(hospital_product_map),
+                sum(len(titles) for titles in hospital_product_map.values()))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(hospital_product_map, indent=2, ensure_ascii=False))
     return hospital_product_map
 
 
 
 def clean_product_name(name, hospital_name=None):
-    cleaned = re.sub(r"^[^-]*-\s*", "", name)
-    cleaned = re.sub(r"\s*\(.*?\)\s*", " ", cleaned)
-    cleaned = re.sub(r"CHRISTUS MUGUERZA", "", cleaned, flags=re.IGNORECASE)
-
-    if hospital_name:
-        possible_aliases = [
-            hospital_name,
-            hospital_name.replace("H. ", "Hospital "),
-            hospital_name.replace("C. ", "Clínica ")
-        ]
-        for alias in possible_aliases:
-            cleaned = re.sub(re.escape(alias), "", cleaned, flags=re.IGNORECASE)
-
-    return re.sub(r"\s{2,}", " ", cleaned).strip()
-
-
-BANNER_GIFS = [
-    "http://img04.en25.com/EloquaImages/clients/Christus/%7B6d051d00-67ac-40cc-8952-2b0639faa692%7D_gif_muguerza_1.gif",
-    "http://img04.en25.com/EloquaImages/clients/Christus/%7B1c4ce003-491f-4fcc-89de-1f98295b015e%7D_gif_muguerza_2.gif",
-    "http://img04.en25.com/EloquaImages/clients/Christus/%7Bea96ab7a-559c-479c-9f4d-805cf90a2359%7D_gif_muguerza_3.gif",
-    "http://img04.en25.com/EloquaImages/clients/Christus/%7Bdd05ab25-a1a5-4d09-9e80-2c1dc14ec0dd%7D_gif_muguerza_4.gif"
-]
-
-def get_fallback_image(product_name):
-    hombre_images = [
-        "https://uxkomf.stripocdn.email/content/guids/CABINET_0347bc35b3efc51497569a7bf5ba974f7d4cd4706262b1fc7ba4d253bd492e16/images/checkupejecutivo_mayor_40.png",
-        "https://uxkomf.stripocdn.email/content/guids/CABINET_0347bc35b3efc51497569a7bf5ba974f7d4cd4706262b1fc7ba4d253bd492e16/images/checkupejecutivo_menor_40.png",
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7B522e17d6-fe96-470f-b54c-aee4ee2b441a%7D_hombre_imagen2.png",
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7B6004ff72-8112-4004-aaff-b9829091951f%7D_hombre_imagen1.png"
-    ]
-
-    mujer_images = [
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7Bc376debc-4c79-4c13-88d6-b0ac4ad8f64d%7D_mujer_imagen3.png",
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7B94918eca-20cb-4c7c-baba-36fb6e141710%7D_mujer_imagen2.png",
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7Bb27377da-3fa0-4d8b-bece-152a949ba108%7D_mujer_imagen4.png",
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7B11a8f1cd-468f-42b9-8071-dd8b12fe0c0c%7D_mujer_imagen1.png"
-    ]
-
-    general_images = [
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7Bd916f173-8bce-40b9-922b-b7e34e87387f%7D_general_imagen1.png",
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7B138547e7-ce71-4d6e-ac99-83bf8d457003%7D_general_imagen2.png",
-        "http://img04.en25.com/EloquaImages/clients/Christus/%7B903a1676-5ee0-4dc0-b19f-3e1194f92d1a%7D_general_imagen3.png"
-    ]
-
-    all_images = hombre_images + mujer_images + general_images
-    name_lower = product_name.lower()
-
-    if "hombre" in name_lower:
-        return random.choice(hombre_images)
-    elif "mujer" in name_lower:
-        return random.choice(mujer_images)
-    else:
-        return random.choice(all_images)
-
-
-def send_to_matrix(product, hospital_product_map, filtered_results):
-    unidad_id = None
-    price = product.get('price', '')
-    product_name = product.get("name")
-    slug = product.get("slug")
-
-    for meta in product.get("meta_data", []):
-        if meta.get("key") == "unidad":
-            raw_value = meta.get("value")
-            if isinstance(raw_value, list) and raw_value:
-                unidad_id = str(raw_value[0])
-            elif raw_value is not None:
-                unidad_id = str(raw_value)
-
-    image_src = get_fallback_image(product_name)
-
-    if unidad_id and unidad_id in hospital_product_map:
-        accepted_titles = set(hospital_product_map[unidad_id])
-        if product_name in accepted_titles:
-            hospital_name = unidad_to_hospital.get(unidad_id)
-            if hospital_name:
-                siglas = hospital_to_siglas[hospital_name].lower()
-                url_id = hospital_to_unidad[hospital_name]["url_id"]
-                constructed_url = (
-                    f"https://christusmuguerza.com.mx/producto/{slug}/"
-                    f"?select_unidad={url_id}"
-                    f"&utm_source=eloqua"
-                    f"&utm_medium=email"
-                    f"&utm_campaign=correos_dinamicos_{siglas}"
-                )
-            else:
-                constructed_url = f"https://christusmuguerza.com.mx/producto/{slug}/"
-
-            filtered_results.setdefault(unidad_id, []).append({
-                'name': product_name,
-                'price': price,
-                'image': image_src,
-                'url': constructed_url,
-                'on_sale': product.get('on_sale', False)
-            })
-
-def match_and_store_products(hospital_product_map):
-    print("🔎 Matching WooCommerce products with Notion data...")
-    filtered_results = {}
-    threads = []
-    for product in fetch_products_stream():
-        thread = threading.Thread(target=send_to_matrix, args=(product, hospital_product_map, filtered_results))
-        threads.append(thread)
-        thread.start()
-    for thread in threads:
-        thread.join()
-    print("✅ Matched Matrix:")
-    print(json.dumps(filtered_results, indent=2, ensure_ascii=False))
+    return name_normalizer.clean(name, hospital_name)
+
+
+image_cache = None
+image_check_pool = None
+image_cache_lock = threading.Lock()
+
+def get_image_cache():
+    global image_cache
+    with image_cache_lock:
+        if image_cache is None and IMAGE_CACHE_PATH:
+            image_cache = ImageCheckCache(IMAGE_CACHE_PATH, IMAGE_CACHE_TTL_DAYS * 86400)
+            image_cache.purge()
+        return image_cache
+
+def close_image_cache():
+    # La cache se comparte entre unidades (y etapas en --async): se reporta y se cierra una vez al final
+    global image_cache
+    with image_cache_lock:
+        cache, image_cache = image_cache, None
+    if not cache:
+        return
+    stats = cache.stats()
+    logger.info("🗄️ Cache de imágenes: %d hits, %d misses", stats["hits"], stats["misses"], extra={"cache": stats})
+    metrics.add_items("image_cache_hits", stats["hits"])
+    metrics.add_items("image_cache_misses", stats["misses"])
+    cache.close()
+
+def get_image_check_pool():
+    # Un solo pool para todo el proceso: en --async varias unidades validan imágenes a la vez
+    global image_check_pool
+    with image_cache_lock:
+        if image_check_pool is None:
+            image_check_pool = ThreadPoolExecutor(max_workers=IMAGE_CHECK_WORKERS)
+        return image_check_pool
+
+def check_image_url(url):
+    try:
+        response = get_http_client("images").head(url, allow_redirects=True, max_retries=1)
+    except requests.RequestException as e:
+        logger.debug("🖼️ Imagen inaccesible %s: %s", url, e)
+        return False
+    if response.status_code != 200 or not response.headers.get("Content-Type", "").startswith("image/"):
+        return False
+    # Sin Content-Length no se puede juzgar el tamaño; basta con que sea una imagen
+    length = int(response.headers.get("Content-Length") or 0)
+    return not length or IMAGE_MIN_BYTES <= length <= IMAGE_MAX_BYTES
+
+def check_image_urls(urls):
+    cache = get_image_cache()
+    valid = set()
+    pending = []
+    for url in dict.fromkeys(urls):
+        ok = cache.get(url) if cache else None
+        if ok is None:
+            pending.append(url)
+        elif ok:
+            valid.add(url)
+
+    if pending:
+        for url, ok in zip(pending, get_image_check_pool().map(check_image_url, pending)):
+            if ok:
+                valid.add(url)
+            if cache:
+                cache.put(url, ok)
+        if cache:
+            cache.commit()
+    metrics.add_items("images_checked", len(pending))
+    return valid
+
+def resolve_product_images(matched_data_matrix):
+    # La primera imagen real del producto si responde y tiene un tamaño razonable; si no, la imagen genérica
+    valid = check_image_urls(
+        product["image"] for products in matched_data_matrix.values() for product in products if product["image"]
+    )
+    fallbacks = 0
+    for unidad_id, products in matched_data_matrix.items():
+        unit = unit_registry.get(unidad_id)
+        for product in products:
+            if product["image"] not in valid:
+                product["image"] = unit.fallback_image(product["name"])
+                fallbacks += 1
+    metrics.add_items("image_fallbacks", fallbacks)
+    return matched_data_matrix
+
+
+def build_product_index(hospital_product_map):
+    # (unidad_id, clave normalizada) -> (unidad, veces pedido en Notion), construido una sola vez desde el mapa
+    product_index = {}
+    for unidad_id, titles in hospital_product_map.items():
+        unit = unit_registry.get(unidad_id)
+        for title in titles:
+            key = (unidad_id, match_key(title))
+            requests_count = product_index[key][1] if key in product_index else 0
+            product_index[key] = (unit, requests_count + 1)
+    return product_index
+
+def send_to_matrix(product, product_index, selector):
+    unidad_id = product.unidad_id
+    product_name = product.name
+    indexed = product_index.get((unidad_id, match_key(product_name)))
+    if indexed is None:
+        return None
+
+    # La unidad ya trae precalculado el sufijo con select_unidad y los parámetros UTM
+    unit, requests_count = indexed
+    constructed_url = unit_registry.product_url(product.slug, unit)
+
+    matched = {
+        'id': product.id,
+        'name': product_name,
+        'price': product.price,
+        'image': product.image,
+        'url': constructed_url,
+        'on_sale': product.on_sale,
+        'requests': requests_count
+    }
+    selector.add(unidad_id, matched)
+    return matched
+
+def match_and_store_products(hospital_product_map, delta=False, ranking=PRODUCT_RANKING):
+    logger.info("🔎 Matching WooCommerce products with Notion data...")
+    product_index = build_product_index(hospital_product_map)
+    # Solo se conservan los EMAIL_MAX_PRODUCTS mejores de cada unidad mientras llega el catálogo
+    selector = TopKSelector(EMAIL_MAX_PRODUCTS, SCORERS[ranking])
+    scanned = 0
+    for product in fetch_products_stream(delta):
+        send_to_matrix(product, product_index, selector)
+        scanned += 1
+    metrics.add_items("woo_products", scanned)
+    matched = selector.offered
+    metrics.add_items("matched_products", matched)
+    filtered_results = selector.results()
+    resolve_product_images(filtered_results)
+    logger.info("✅ Matched Matrix: %d coincidencias, %d productos elegidos en %d unidades", matched,
+                sum(len(products) for products in filtered_results.values()), len(filtered_results))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(filtered_results, indent=2, ensure_ascii=False))
     return filtered_results
 
-def load_email_template():
-    with open("email.html", "r", encoding="utf-8") as f:
-        return f.read()
-
-def generate_email_html(products):
-    html = """
-    <style>
-    @media only screen and (max-width: 600px) {
-        .product-column {
-            display: inline-block !important;
-            width: 50% !important;
-            max-width: 50% !important;
-            box-sizing: border-box;
-        }
-    }
-    </style>
-    <!--[if mso]>
-    <style type="text/css">
-        .fallback-table {width: 100% !important;}
-    </style>
-    <![endif]-->
-    <table role="presentation" cellpadding="0" cellspacing="0" border="0" align="center" style="border-collapse: collapse; width:100%; max-width:600px; margin:0 auto;">
-    """
-
-    total = len(products)
-    per_row = 3
-
-    for i in range(0, total, per_row):
-        chunk = products[i:i + per_row]
-        num_items = len(chunk)
-
-        spacer_td = ''
-        if num_items == 1:
-            spacer_td = '<td width="33%"></td>'
-        elif num_items == 2:
-            spacer_td = '<td width="16.5%"></td>'
-
-        html += "<tr>"
-
-        if spacer_td:
-            html += spacer_td
-
-        for product in chunk:
-            on_sale = product.get("on_sale", False)
-            button_text = "En Oferta" if on_sale else "Ver producto"
-            button_color = "#EC8F4F" if on_sale else "#6D247A"
-            button_border = "#EC8F4F" if on_sale else "#6D247A"
-
-            html += f"""
-            <td class="product-column" align="center" valign="top" style="padding: 10px; vertical-align: top; width: 290px; max-width: 33.33%;">
-                <table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse; background-color: white; height: 400px; table-layout: fixed;">
-                    <tr>
-                        <td align="center" style="height: 180px;">
-                            <img src="{product['image']}" alt="{product['name']}" width="180px" style="display: block; max-width: 100%; height: auto;" />
-                        </td>
-                    </tr>
-                    <tr>
-                        <td align="center" style="font-family: 'Satoshi', Arial, sans-serif; font-size: 22px; line-height: 14px; color: #636A6B; height: 80px; vertical-align: middle;">
-                            <div style="display: -webkit-box; -webkit-line-clamp: 3; -webkit-box-orient: vertical; overflow: hidden; text-overflow: ellipsis; max-height: 100px; line-height: 22px; margin: 0 auto;">
-                                {product['name']}
-                            </div>
-                        </td>
-                    </tr>
-                    <tr>
-                        <td align="center" style="font-family: 'Satoshi', Arial, sans-serif; font-size: 14px; font-weight: bold; color: #6D247A; height: 50px; vertical-align: bottom;">
-                            ${product['price']}
-                        </td>
-                    </tr>
-                    <tr>
-                        <td align="center" style="padding: 10px 0; vertical-align: top;">
-                            <a href="{product['url']}" style="
-                                display: inline-block;
-                                padding: 10px 26px;
-                                text-decoration: none;
-                                font-size: 18px;
-                                border: 2px solid {button_border};
-                                border-radius: 24px;
-                                color: white;
-                                background-color: {button_color};
-                                font-family: 'Satoshi', Arial, sans-serif;
-                            ">{button_text}</a>
-                        </td>
-                    </tr>
-                </table>
-            </td>
-            """
-
-        if spacer_td:
-            html += spacer_td
-
-        html += "</tr>"
-
-    html += "</table>"
-    return html
-
-
-def get_end_of_month_date():
-    today = datetime.today()
-    next_month = today.replace(day=28) + timedelta(days=4)  # Te lleva al próximo mes
-    end_of_month = next_month - timedelta(days=next_month.day)
-    return end_of_month.strftime("%d de %B de %Y")  # Ej: '30 de junio de 2025'
-
-def generate_legal_disclaimer():
-    end_date = get_end_of_month_date()
-    return f"""
-    <table role="presentation" cellpadding="0" cellspacing="0" border="0" align="center" width="100%" style="max-width:600px; margin:20px auto 0;">
-      <tr>
-        <td align="center" style="padding: 10px 20px;">
-          <p style="
-            margin: 0;
-            font-family: 'Satoshi', Arial, sans-serif;
-            font-size: 11px;
-            color: #636A6B;
-            line-height: 1.5;
-          ">
-            Aplican restricciones. Precios exclusivos en tienda en línea. Promociones y descuentos sujetos a cambios sin previo aviso.
-            Una vez realizado el pago, comunicarse a la sucursal para mayor información. Algunos productos requieren cita previa.<br>
-            Vigencia al {end_date}.
-          </p>
-        </td>
-      </tr>
-    </table>
-    """
-
-
-def inject_random_banner(html_template):
-    # Reemplaza la URL original de la imagen por un GIF aleatorio
-    original_banner_url = "http://img04.en25.com/EloquaImages/clients/Christus/%7B3952c7f5-400c-4741-957c-2f4b15ee8d01%7D_image_5ss.png"
-    random_gif = random.choice(BANNER_GIFS)
-    return html_template.replace(original_banner_url, random_gif)
+email_renderer = None
 
+def get_email_renderer():
+    # La plantilla se carga y divide una sola vez por ejecución
+    global email_renderer
+    if email_renderer is None:
+        email_renderer = EmailRenderer()
+    return email_renderer
 
-def send_email_to_eloqua(hospital_name, unidad_id, products):
+
+def build_email(hospital_name, unidad_id, products):
     now = datetime.now()
     month_year = now.strftime("%B %Y")  # e.g. "June 2025"
     email_name = f"Productos - {hospital_name} - {month_year}"
-    product_html = generate_email_html(products[:6])
-    template = load_email_template()
-    template = inject_random_banner(template)
-    full_html = template.replace("<!-- PRODUCT_GRID_HERE -->", product_html)
-    
-    legal_html = generate_legal_disclaimer()
-    full_html = full_html.replace("<!-- LEGAL_DISCLAIMER -->", legal_html)
+    renderer = get_email_renderer()
+    products = products[:EMAIL_MAX_PRODUCTS]
+    html = renderer.render(products)
+    raw_bytes = len(html.encode("utf-8"))
+    if EMAIL_MINIFY:
+        html = optimize_html(html, EMAIL_FACTOR_STYLES)
+    html_bytes = len(html.encode("utf-8"))
+    logger.info("🗜️ HTML de %s: %d -> %d bytes", hospital_name, raw_bytes, html_bytes,
+                extra={"unidad_id": unidad_id, "html_bytes_raw": raw_bytes, "html_bytes": html_bytes})
+    metrics.add_items("html_bytes_raw", raw_bytes)
+    metrics.add_items("html_bytes", html_bytes)
+    return {
+        "unidad_id": unidad_id,
+        "hospital": hospital_name,
+        "name": email_name,
+        "products": len(products),
+        "html": html,
+        "digest": renderer.content_digest(products)
+    }
 
+def render_unit_email(unidad_id, products):
+    unit = unit_registry.get(unidad_id)
+    hospital_name = unit.hospital if unit else f"Unidad {unidad_id}"
+    products = products[:EMAIL_MAX_PRODUCTS]
+    names = name_normalizer.clean_batch([product["name"] for product in products], hospital_name)
+    products = [{**product, "name": name} for product, name in zip(products, names)]
+    return build_email(hospital_name, unidad_id, products)
+
+def render_emails(matched_data_matrix, processes=1):
+    units = {unidad_id: products for unidad_id, products in matched_data_matrix.items() if products}
+    if processes > 1:
+        rendered = {}
+        for chunk in run_in_processes(render_worker, units, processes):
+            rendered.update(chunk)
+        return rendered
+    return {unidad_id: render_unit_email(unidad_id, products) for unidad_id, products in units.items()}
+
+def rejects_gzip(response):
+    # 415, o un 400 que menciona la codificación; otros 400 son errores de validación del propio correo
+    if response.status_code == 415:
+        return True
+    return response.status_code == 400 and any(word in response.text.lower() for word in ("encoding", "gzip"))
+
+def send_to_eloqua(method, path, payload):
+    global eloqua_gzip
+    client = get_http_client("eloqua")
+    # Un POST que vence por lectura puede haber creado el asset: no se reintenta para no dejar uno huérfano
+    idempotent = method != "POST"
+    if eloqua_gzip:
+        response = client.request(method, path, limiter=eloqua_limiter, compress=True, json=payload,
+                                  idempotent=idempotent)
+        if not rejects_gzip(response):
+            return response
+        # El endpoint no acepta gzip: el resto de la ejecución se envía sin comprimir
+        logger.warning("⚠️ Eloqua rechazó el cuerpo comprimido (%s), se envía sin comprimir", response.status_code)
+        eloqua_gzip = False
+    return client.request(method, path, limiter=eloqua_limiter, json=payload, idempotent=idempotent)
+
+def publish_rendered_email(email):
+    hospital_name = email["hospital"]
     payload = {
-        "name": email_name,
-        "subject": email_name,
+        "name": email["name"],
+        "subject": email["name"],
         "emailGroupId": 1,
         "folderId": int(ELOQUA_FOLDER_ID),
         "htmlContent": {
             "type": "RawHtmlContent",
-            "html": full_html
+            "html": email["html"]
         },
         "encodingId": 1,
         "isTracked": True,
         "isContentProtected": False
     }
 
-    print(f"📤 Sending email to Eloqua for {hospital_name}...")
-    print(json.dumps(payload, indent=2, ensure_ascii=False))
-
-    url = "https://secure.p04.eloqua.com/API/REST/2.0/assets/email"
-    response = requests.post(url, headers=get_eloqua_auth_header(), json=payload)
-
+    logger.info("📤 Sending email to Eloqua for %s...", hospital_name)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(payload, indent=2, ensure_ascii=False))
+
+    result = {
+        "hospital": hospital_name,
+        "unidad_id": email["unidad_id"],
+        "products": email["products"],
+        "status": "failed",
+        "status_code": None,
+        "asset_id": None,
+        "digest": email.get("digest"),
+        "error": None
+    }
+    asset_id = email.get("asset_id")
+    try:
+        if asset_id:
+            # El asset de este mes ya existe: se actualiza en lugar de crear un duplicado
+            response = send_to_eloqua("PUT", f"assets/email/{asset_id}", {**payload, "id": asset_id})
+            if response.status_code == 200:
+                logger.info("♻️ Email %s updated for %s with %d products.", asset_id, hospital_name, email["products"])
+                result.update({"status": "updated", "status_code": 200, "asset_id": asset_id})
+                return result
+            if response.status_code != 404:
+                logger.error("❌ Failed to update email %s for %s: %s", asset_id, hospital_name, response.status_code)
+                result.update({"status_code": response.status_code, "error": response.text})
+                return result
+            logger.warning("⚠️ Email %s de %s ya no existe en Eloqua, se crea uno nuevo", asset_id, hospital_name)
+
+        response = send_to_eloqua("POST", "assets/email", payload)
+    except requests.RequestException as e:
+        logger.error("❌ Failed to publish email for %s: %s", hospital_name, e)
+        result["error"] = str(e)
+        return result
+
+    result["status_code"] = response.status_code
     if response.status_code == 201:
-        print(f"✅ Email created for {hospital_name} with {len(products[:6])} products.")
+        logger.info("✅ Email created for %s with %d products.", hospital_name, email["products"])
+        result["status"] = "created"
+        result["asset_id"] = response.json().get("id")
+    else:
+        logger.error("❌ Failed to create email for %s: %s", hospital_name, response.status_code)
+        logger.error("Response: %s", response.text)
+        result["error"] = response.text
+    return result
+
+def send_email_to_eloqua(hospital_name, unidad_id, products):
+    return publish_rendered_email(build_email(hospital_name, unidad_id, products))
+
+def publish_units(rendered_emails, max_workers=ELOQUA_MAX_WORKERS, store=None, on_result=None):
+    def publish(email):
+        result = publish_rendered_email(email)
+        # Se marca en cuanto se publica para que --resume no la vuelva a enviar
+        if store and result["status"] != "failed":
+            store.mark_published(email["unidad_id"], result)
+        if on_result:
+            on_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(publish, rendered_emails.values()))
+
+shared_data = {}
+worker_store = None
+log_settings = ("INFO", "text")
+
+# Globales que --dry-run o la ejecución pueden cambiar; con spawn (Windows, macOS) el hijo reimporta el módulo
+# y solo vería los valores del entorno, así que se le pasan explícitamente
+WORKER_CONFIG = (
+    "NOTION_API_URL", "WOO_URL", "ELOQUA_API_URL", "DATABASE_ID", "DATABASE_ID_PRODUCTS", "ELOQUA_FOLDER_ID",
+    "NOTION_CACHE_PATH", "NOTION_SYNC_STATE_PATH", "WOO_SNAPSHOT_PATH", "ARTIFACTS_DIR", "ELOQUA_DIGESTS_PATH",
+    "IMAGE_CACHE_PATH", "eloqua_gzip", "log_settings",
+)
+
+def get_worker_config():
+    return {name: globals()[name] for name in WORKER_CONFIG}
+
+def init_worker(data, rate_limit, store_location, config):
+    # Cada proceso recibe los datos una sola vez y solo los lee; el límite de Eloqua se reparte entre procesos
+    global shared_data, eloqua_limiter, worker_store
+    globals().update(config)
+    setup_logging(*log_settings)
+    shared_data = data
+    eloqua_limiter = TokenBucket(rate_limit)
+    worker_store = ArtifactStore(*store_location) if store_location else None
+    reset_http_clients(close=False)
+    metrics.reset()
+
+def render_worker(unit_ids):
+    rendered = {unidad_id: render_unit_email(unidad_id, shared_data[unidad_id]) for unidad_id in unit_ids}
+    return rendered, metrics.snapshot()
+
+def publish_worker(unit_ids, max_workers):
+    results = publish_units({unidad_id: shared_data[unidad_id] for unidad_id in unit_ids}, max_workers, worker_store)
+    return results, metrics.snapshot()
+
+def run_in_processes(worker, data, processes, *args, store_location=None):
+    units = list(data)
+    chunks = [chunk for chunk in (units[i::processes] for i in range(processes)) if chunk]
+    if not chunks:
+        return
+    with ProcessPoolExecutor(
+        max_workers=len(chunks),
+        initializer=init_worker,
+        initargs=(data, ELOQUA_RATE_LIMIT / len(chunks), store_location, get_worker_config())
+    ) as pool:
+        for output, snapshot in pool.map(worker, chunks, *(repeat(arg) for arg in args)):
+            metrics.merge(snapshot)
+            yield output
+
+def log_publish_summary(results):
+    logger.info("📋 Resumen de publicación:")
+    for result in results:
+        icon = "✅" if result["status"] != "failed" else "❌"
+        logger.info("%s %s (%s): %s [%s] %d productos", icon, result["hospital"], result["unidad_id"],
+                    result["status"], result["status_code"], result["products"], extra={"result": result})
+
+def publish_emails(rendered_emails, max_workers=ELOQUA_MAX_WORKERS, processes=1, store=None, digests=None,
+                   force=False):
+    campaign = get_month_start().strftime("%Y-%m")
+    results = []
+    pending = {}
+    for unidad_id, email in rendered_emails.items():
+        previous = digests.get(unidad_id, campaign) if digests else None
+        if previous and previous["digest"] == email.get("digest") and not force:
+            logger.info("⏭️ Sin cambios para %s, no se vuelve a publicar", email["hospital"])
+            results.append({
+                "hospital": email["hospital"],
+                "unidad_id": unidad_id,
+                "products": email["products"],
+                "status": "unchanged",
+                "status_code": None,
+                "asset_id": previous["asset_id"],
+                "digest": previous["digest"],
+                "error": None
+            })
+            continue
+        pending[unidad_id] = {**email, "asset_id": previous["asset_id"]} if previous else email
+
+    def record_digest(result):
+        if digests and result["status"] in ("created", "updated"):
+            email = pending[result["unidad_id"]]
+            digests.record(result["unidad_id"], campaign, result["digest"], result["asset_id"], email["name"])
+
+    if processes > 1:
+        store_location = (store.root, store.run_key) if store else None
+        for chunk_results in run_in_processes(publish_worker, pending, processes, max_workers,
+                                              store_location=store_location):
+            for result in chunk_results:
+                record_digest(result)
+            results.extend(chunk_results)
     else:
-        print(f"❌ Failed to create email for {hospital_name}: {response.status_code}")
-        print("Response:", response.text)
+        results.extend(publish_units(pending, max_workers, store, record_digest))
+    for result in results:
+        metrics.add_items(f"emails_{result['status']}")
+    return results
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("el shard debe tener la forma i/n, por ejemplo 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard fuera de rango: {value}")
+    return index, count
+
+def select_units(unit_ids, units=None, shard=None):
+    selected = sorted(unit_ids)
+    if units:
+        wanted = set()
+        for unit in units:
+            unit = unit.strip()
+            registered = unit_registry.by_name(unit)
+            wanted.add(registered.unidad_id if registered else unit)
+        selected = [unidad_id for unidad_id in selected if unidad_id in wanted]
+    if shard:
+        # Hash estable: una unidad se queda en el mismo shard aunque se agreguen otras
+        index, count = shard
+        selected = [unidad_id for unidad_id in selected if zlib.crc32(unidad_id.encode()) % count == index]
+    return selected
+
+def write_shard_results(results, shard, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    index, count = shard
+    path = os.path.join(output_dir, f"shard-{index}-of-{count}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"shard": index, "shards": count, "results": results}, f, ensure_ascii=False, indent=2)
+    logger.info("💾 Resultados del shard %d/%d escritos en %s", index, count, path)
+    return path
+
+def merge_shard_results(output_dir):
+    merged = []
+    seen = set()
+    expected = None
+    for path in sorted(glob.glob(os.path.join(output_dir, "shard-*-of-*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        expected = expected or data["shards"]
+        seen.add(data["shard"])
+        merged.extend(data["results"])
+
+    missing = sorted(set(range(expected or 0)) - seen)
+    if missing:
+        logger.warning("⚠️ Faltan resultados de los shards: %s", missing)
+    merged.sort(key=lambda result: result["unidad_id"])
+    summary_path = os.path.join(output_dir, "publish_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump({"shards": expected, "missing_shards": missing, "results": merged}, f, ensure_ascii=False, indent=2)
+    log_publish_summary(merged)
+    logger.info("📦 Resumen combinado escrito en %s", summary_path)
+    return merged, missing
+
+def configure_dry_run(base_url):
+    # Apunta todas las APIs a los servidores locales de fake_apis.py
+    global NOTION_API_URL, WOO_URL, ELOQUA_API_URL, DATABASE_ID, DATABASE_ID_PRODUCTS
+    global ELOQUA_FOLDER_ID, NOTION_CACHE_PATH, NOTION_SYNC_STATE_PATH, WOO_SNAPSHOT_PATH, ARTIFACTS_DIR
+    global ELOQUA_DIGESTS_PATH, IMAGE_CACHE_PATH
+    from fake_apis import FORMS_DATABASE_ID
+
+    NOTION_API_URL = f"{base_url}/notion/v1"
+    WOO_URL = f"{base_url}/woo/products"
+    ELOQUA_API_URL = f"{base_url}/eloqua"
+    DATABASE_ID = FORMS_DATABASE_ID
+    DATABASE_ID_PRODUCTS = None
+    ELOQUA_FOLDER_ID = ELOQUA_FOLDER_ID or "0"
+
+    # La ejecución en seco no lee ni escribe el estado local real
+    state_dir = tempfile.mkdtemp(prefix="emails-dry-run-")
+    NOTION_CACHE_PATH = ""
+    IMAGE_CACHE_PATH = os.path.join(state_dir, "image_cache.sqlite")
+    NOTION_SYNC_STATE_PATH = os.path.join(state_dir, "notion_sync.json")
+    WOO_SNAPSHOT_PATH = os.path.join(state_dir, "woo_snapshot.json")
+    ARTIFACTS_DIR = os.path.join(state_dir, "artifacts")
+    ELOQUA_DIGESTS_PATH = os.path.join(state_dir, "eloqua_digests.json")
+    reset_http_clients()
+
+def start_dry_run(entries, products):
+    from fake_apis import SyntheticWorkload, FakeApiServer
+
+    units = [(unit.hospital, unit.unidad_id) for unit in unit_registry]
+    workload = SyntheticWorkload(units, entries=entries, products=products)
+    server = FakeApiServer(workload).start()
+    configure_dry_run(server.base_url)
+    logger.info("🧪 Dry run: %d entradas y %d productos sintéticos en %s", entries, products, server.base_url)
+    return server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Genera y publica los correos dinámicos por hospital.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Descarga solo las entradas de Notion editadas desde la última ejecución")
+    parser.add_argument("--woo-delta", action="store_true",
+                        help="Descarga solo los productos de WooCommerce modificados desde el último snapshot")
+    parser.add_argument("--workers", type=int, default=ELOQUA_MAX_WORKERS,
+                        help="Número de correos publicados en paralelo en Eloqua")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Ejecuta contra servidores locales que imitan Notion, WooCommerce y Eloqua")
+    parser.add_argument("--dry-run-entries", type=int, default=500,
+                        help="Entradas de Notion sintéticas para --dry-run")
+    parser.add_argument("--dry-run-products", type=int, default=5000,
+                        help="Productos de WooCommerce sintéticos para --dry-run")
+    parser.add_argument("--units", type=lambda value: value.split(","),
+                        help="Unidades a procesar, por unidad_id o nombre, separadas por comas")
+    parser.add_argument("--shard", type=parse_shard,
+                        help="Procesa solo el shard i de n (por ejemplo 0/4) para repartir unidades entre máquinas")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Procesos que renderizan y publican las unidades seleccionadas")
+    parser.add_argument("--shard-output", default="shards",
+                        help="Directorio donde cada shard escribe sus resultados")
+    parser.add_argument("--merge-shards", metavar="DIR",
+                        help="Solo combina los resultados de los shards de DIR y termina")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reutiliza las etapas ya completadas y no vuelve a publicar unidades ya enviadas")
+    parser.add_argument("--artifacts-dir", help=f"Directorio de artefactos por etapa (por defecto {ARTIFACTS_DIR})")
+    parser.add_argument("--ranking", choices=sorted(SCORERS), default=PRODUCT_RANKING,
+                        help="Criterio para elegir los productos de cada correo (por defecto %(default)s)")
+    parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="Cruza Notion y WooCommerce al mismo tiempo y publica cada unidad en cuanto está completa")
+    parser.add_argument("--force-publish", action="store_true",
+                        help="Publica aunque el contenido de la unidad no haya cambiado desde la última ejecución")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "INFO"),
+                        help="Nivel de log; DEBUG incluye los volcados JSON completos")
+    parser.add_argument("--log-format", choices=["text", "json"], default=os.getenv("LOG_FORMAT", "text"))
+    parser.add_argument("--report", default=os.getenv("RUN_REPORT_PATH", "run_report.json"),
+                        help="Archivo JSON con las métricas de la ejecución")
+    parser.add_argument("--prometheus", default=os.getenv("PROMETHEUS_TEXTFILE"),
+                        help="Archivo .prom opcional para el textfile collector de node_exporter")
+    args = parser.parse_args()
+    if args.async_mode and (args.resume or args.processes > 1):
+        parser.error("--async no se combina con --resume ni con --processes")
+    return args
+
+def run_cached_stage(store, resume, artifact, stage, input_hash, compute):
+    if resume:
+        data, digest = store.load(artifact, input_hash)
+        if data is not None:
+            logger.info("⏭️ Etapa %s reutilizada desde %s", stage, store.path)
+            return data, digest
+    with metrics.stage(stage):
+        data = compute()
+    return data, store.save(artifact, data, input_hash)
+
+def run_pipeline(args, selected_units, eloqua_auth=None):
+    run_key = f"{get_month_start().strftime('%Y-%m')}-{content_hash(sorted(selected_units))[:12]}"
+    store = ArtifactStore(args.artifacts_dir or ARTIFACTS_DIR, run_key)
+    if not args.resume:
+        store.clear()
+
+    logger.info("Fetching products and matching with Notion data...")
+    hospital_product_map, map_hash = run_cached_stage(
+        store, args.resume, "hospital_product_map", "build_hospital_product_map", "",
+        lambda: build_hospital_product_map(args.incremental, selected_units))
+    if eloqua_auth and not eloqua_auth.result():
+        return None
+    matched_data_matrix, matrix_hash = run_cached_stage(
+        store, args.resume, "matched_matrix", "match_and_store_products", f"{map_hash}:{args.ranking}",
+        lambda: match_and_store_products(hospital_product_map, args.woo_delta, args.ranking))
+    rendered_emails, _ = run_cached_stage(
+        store, args.resume, "rendered_emails", "render_emails", matrix_hash,
+        lambda: render_emails(matched_data_matrix, args.processes))
+
+    published = store.published() if args.resume else {}
+    pending = {unidad_id: email for unidad_id, email in rendered_emails.items() if unidad_id not in published}
+    if published:
+        logger.info("⏭️ %d unidades ya publicadas, %d pendientes", len(published), len(pending))
+
+    logger.info("Sending emails to Eloqua...")
+    digests = DigestStore(ELOQUA_DIGESTS_PATH)
+    with metrics.stage("send_email_to_eloqua"):
+        results = publish_emails(pending, args.workers, args.processes, store, digests, args.force_publish)
+    results = sorted(list(published.values()) + results, key=lambda result: result["unidad_id"])
+    log_publish_summary(results)
+    return results
+
+async def crawl_products(queue, delta=False):
+    # El crawl usa requests en un hilo; cada put espera a que haya lugar en la cola
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+
+    def put(item):
+        # Si el cruce falló nadie vacía la cola: se deja de esperar en vez de bloquear el hilo para siempre
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stop.is_set():
+            try:
+                future.result(timeout=ASYNC_STOP_POLL_SECONDS)
+                return True
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def crawl():
+        # Lotes de una página: un cruce entre hilos por producto costaría más que el propio matching
+        products = fetch_products_stream(delta)
+        try:
+            while not stop.is_set() and (batch := list(islice(products, ASYNC_BATCH_SIZE))):
+                if not put(batch):
+                    return
+        finally:
+            products.close()
+        put(None)
+
+    with metrics.stage("crawl_products"):
+        try:
+            await loop.run_in_executor(None, crawl)
+        finally:
+            stop.set()
+
+async def match_products_async(products_queue, units_queue, map_task, selected_units, ranking=PRODUCT_RANKING):
+    # Los productos que llegan antes que el mapa de Notion se guardan; después se cruzan al vuelo
+    hospital_product_map = None
+    product_index = None
+    expected = {}
+    seen = {}
+    emitted = set()
+    selector = TopKSelector(EMAIL_MAX_PRODUCTS, SCORERS[ranking])
+    waiting = []
+    scanned = 0
+    get_task = None
+
+    async def emit(unidad_id):
+        emitted.add(unidad_id)
+        await units_queue.put((unidad_id, selector.selected(unidad_id)))
+
+    async def handle(product):
+        unidad_id = product.unidad_id
+        if unidad_id in emitted or not send_to_matrix(product, product_index, selector):
+            return
+        seen.setdefault(unidad_id, set()).add(match_key(product.name))
+        # La unidad ya tiene todos los productos que pidió Notion: se publica sin esperar al resto del catálogo
+        if len(seen[unidad_id]) >= expected[unidad_id]:
+            await emit(unidad_id)
+
+    async def index_ready():
+        nonlocal hospital_product_map, product_index, expected, waiting
+        hospital_product_map = await map_task
+        product_index = build_product_index(hospital_product_map)
+        expected = {unidad_id: len({match_key(title) for title in titles})
+                    for unidad_id, titles in hospital_product_map.items()}
+        logger.info("🔗 Mapa de Notion listo; %d productos de WooCommerce en espera", len(waiting))
+        for product in waiting:
+            await handle(product)
+        waiting = []
+
+    while True:
+        if product_index is None and len(waiting) >= ASYNC_WAITING_LIMIT:
+            await index_ready()
+        if product_index is None:
+            get_task = get_task or asyncio.ensure_future(products_queue.get())
+            done, _ = await asyncio.wait({get_task, map_task}, return_when=asyncio.FIRST_COMPLETED)
+            if map_task in done:
+                await index_ready()
+            if get_task not in done:
+                continue
+            batch = get_task.result()
+            get_task = None
+        elif get_task:
+            # Lectura que quedó en curso cuando el mapa estuvo listo; su lote no se puede perder
+            batch = await get_task
+            get_task = None
+        else:
+            batch = await products_queue.get()
+        if batch is None:
+            break
+        scanned += len(batch)
+        for product in batch:
+            if product_index is not None:
+                await handle(product)
+            elif product.unidad_id in selected_units:
+                waiting.append(product)
+
+    if product_index is None:
+        await index_ready()
+    # Fin del crawl: las unidades incompletas se publican con lo que se encontró
+    for unidad_id in sorted(set(selector.heaps) - emitted):
+        await emit(unidad_id)
+    await units_queue.put(None)
+
+    metrics.add_items("woo_products", scanned)
+    metrics.add_items("matched_products", selector.offered)
+    return hospital_product_map, selector.results()
+
+class EloquaAuthError(Exception):
+    pass
+
+async def publish_units_async(units_queue, max_workers, store, digests, force=False, eloqua_auth=None):
+    if eloqua_auth and not await asyncio.wrap_future(eloqua_auth):
+        # Sin credenciales no se publica nada: se cortan también Notion y el crawl, como en el modo por etapas
+        raise EloquaAuthError()
+
+    # El semáforo se toma antes de leer la cola: si Eloqua va lento la cola se llena y frena el cruce
+    semaphore = asyncio.Semaphore(max_workers)
+    results = []
+    tasks = []
+
+    async def publish(unidad_id, products):
+        try:
+            await asyncio.to_thread(resolve_product_images, {unidad_id: products})
+            email = await asyncio.to_thread(render_unit_email, unidad_id, products)
+            results.extend(await asyncio.to_thread(publish_emails, {unidad_id: email}, 1, 1, store, digests, force))
+        finally:
+            semaphore.release()
+
+    while True:
+        await semaphore.acquire()
+        item = await units_queue.get()
+        if item is None:
+            semaphore.release()
+            break
+        tasks.append(asyncio.create_task(publish(*item)))
+    await asyncio.gather(*tasks)
+    return results
+
+async def run_stages(*coroutines):
+    # Si una etapa falla se cancelan las demás; con colas acotadas se quedarían esperando para siempre
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in tasks:
+        if task in done and task.exception():
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+async def run_async_pipeline(args, selected_units, eloqua_auth=None):
+    # Notion, WooCommerce y Eloqua trabajan a la vez; la duración se acerca a la de la API más lenta
+    run_key = f"{get_month_start().strftime('%Y-%m')}-{content_hash(sorted(selected_units))[:12]}"
+    store = ArtifactStore(args.artifacts_dir or ARTIFACTS_DIR, run_key)
+    store.clear()
+    digests = DigestStore(ELOQUA_DIGESTS_PATH)
+    products_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    units_queue = asyncio.Queue(maxsize=max(args.workers, 1))
+
+    def build_map():
+        with metrics.stage("build_hospital_product_map"):
+            return build_hospital_product_map(args.incremental, selected_units)
+
+    logger.info("⚡ Modo asíncrono: Notion, WooCommerce y Eloqua en paralelo")
+    with metrics.stage("async_pipeline"):
+        notion_stop.clear()
+        map_task = asyncio.ensure_future(asyncio.to_thread(build_map))
+        try:
+            _, (hospital_product_map, matched_data_matrix), results = await run_stages(
+                crawl_products(products_queue, args.woo_delta),
+                match_products_async(products_queue, units_queue, map_task, selected_units, args.ranking),
+                publish_units_async(units_queue, args.workers, store, digests, args.force_publish, eloqua_auth),
+            )
+        except EloquaAuthError:
+            notion_stop.set()
+            return None
+        except BaseException:
+            notion_stop.set()
+            raise
+        finally:
+            map_task.cancel()
+
+    # Se guardan los mismos artefactos que en el modo por etapas, para inspección
+    map_hash = store.save("hospital_product_map", hospital_product_map)
+    store.save("matched_matrix", matched_data_matrix, map_hash)
+    results.sort(key=lambda result: result["unidad_id"])
+    log_publish_summary(results)
+    return results
+
+def write_run_report(report_path, prometheus_path=None):
+    if report_path:
+        metrics.write_json_report(report_path)
+        logger.info("📈 Reporte de ejecución escrito en %s", report_path)
+    if prometheus_path:
+        metrics.write_prometheus_textfile(prometheus_path)
 
 if __name__ == "__main__":
-    if not test_eloqua_auth():
-        exit()
+    args = parse_args()
+    log_settings = (args.log_level, args.log_format)
+    setup_logging(*log_settings)
+    if args.merge_shards:
+        merged, missing = merge_shard_results(args.merge_shards)
+        exit(1 if missing or any(result["status"] == "failed" for result in merged) else 0)
 
-    print("Fetching products and matching with Notion data...")
-    hospital_product_map = build_hospital_product_map()
-    matched_data_matrix = match_and_store_products(hospital_product_map)
+    server = start_dry_run(args.dry_run_entries, args.dry_run_products) if args.dry_run else None
+    eloqua_auth = start_eloqua_auth_probe()
 
-    print("\nSending emails to Eloqua...")
-    for unidad_id, products in matched_data_matrix.items():
-        if products:
-            hospital_name = unidad_to_hospital.get(unidad_id, f"Unidad {unidad_id}")
-            
-            for product in products:
-                product["name"] = clean_product_name(product["name"], hospital_name)
+    selected_units = set(select_units(unit_registry.by_id, args.units, args.shard))
+    logger.info("🏥 Unidades seleccionadas: %d de %d", len(selected_units), len(unit_registry))
 
-            send_email_to_eloqua(hospital_name, unidad_id, products)
\ No newline at end of file
+    if args.async_mode:
+        results = asyncio.run(run_async_pipeline(args, selected_units, eloqua_auth))
+    else:
+        results = run_pipeline(args, selected_units, eloqua_auth)
+    close_image_cache()
+    if results is None:
+        if server:
+            server.stop()
+        exit()
+    if args.shard:
+        write_shard_results(results, args.shard, args.shard_output)
+    write_run_report(args.report, args.prometheus)
+    if server:
+        logger.info("🧪 Peticiones a los servidores locales: %s", server.stats())
+        server.stop()
+    if any(result["status"] == "failed" for result in results):
+        exit(1)
@@ -0,0 +1,303 @@
+import json, random, threading, time, multiprocessing, gzip
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from urllib.request import urlopen
+
+# Servidores locales que imitan Notion, WooCommerce y Eloqua para --dry-run y benchmarks
+
+FORMS_DATABASE_ID = "dry-run-forms"
+PRODUCTS_DATABASE_ID = "dry-run-products"
+
+PRODUCT_KINDS = ["Check up", "Paquete", "Estudio", "Consulta", "Vacuna", "Ultrasonido", "Perfil"]
+AUDIENCES = ["Hombre", "Mujer", "Infantil", "Ejecutivo", "Integral"]
+
+
+class SyntheticWorkload:
+    def __init__(self, units, entries=5000, products=50000, products_per_entry=3, seed=0):
+        # units: lista de (hospital_name, unidad_id)
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        self.units = list(units)
+        self.products = []
+        self.pages = {}
+        unit_pages = {unidad_id: [] for _, unidad_id in self.units}
+
+        for i in range(products):
+            hospital_name, unidad_id = self.units[i % len(self.units)]
+            name = f"{rng.choice(PRODUCT_KINDS)} {rng.choice(AUDIENCES)} {i + 1}"
+            price = f"{rng.randrange(500, 20000, 50)}.00"
+            self.products.append({
+                "id": i + 1,
+                "sku": f"SKU{i + 1:06d}",
+                "name": name,
+                "slug": f"producto-{i + 1}",
+                "price": price,
+                "permalink": f"https://christusmuguerza.com.mx/producto/producto-{i + 1}/",
+                "on_sale": rng.random() < 0.2,
+                "status": "publish" if rng.random() < 0.9 else "draft",
+                "meta_data": [
+                    {"id": i * 2 + 1, "key": "_wc_review_count", "value": "0"},
+                    {"id": i * 2 + 2, "key": "unidad", "value": [unidad_id]},
+                ],
+                "attributes": [],
+                # Rutas relativas: el servidor las completa con su propio host al responder
+                "images": [{"id": i + 1, "src": f"/images/producto-{i + 1}.png"}] if i % 20 else [],
+            })
+            page_id = f"page-{i + 1}"
+            self.pages[page_id] = {
+                "object": "page",
+                "id": page_id,
+                "created_time": now,
+                "last_edited_time": now,
+                "properties": {
+                    "Nombre": {"id": "title", "type": "title", "title": [{"plain_text": f"{hospital_name} - {name}"}]},
+                    "Unidad": {"id": "unid", "type": "select", "select": {"name": hospital_name}},
+                },
+            }
+            unit_pages[unidad_id].append(page_id)
+
+        # Las entradas se concentran en los productos más populares de cada unidad
+        self.entries = []
+        for i in range(entries):
+            hospital_name, unidad_id = rng.choice(self.units)
+            candidates = unit_pages[unidad_id][:30]
+            relations = rng.sample(candidates, min(products_per_entry, len(candidates)))
+            self.entries.append({
+                "object": "page",
+                "id": f"entry-{i + 1}",
+                "created_time": now,
+                "last_edited_time": now,
+                "properties": {
+                    "Unidad de servicio": {"id": "unds", "type": "select", "select": {"name": hospital_name}},
+                    "Productos": {"id": "prod", "type": "relation", "relation": [{"id": r} for r in relations]},
+                },
+            })
+
+        self.published_products = [p for p in self.products if p["status"] == "publish"]
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    # Keep-alive como las APIs reales; todas las respuestas llevan Content-Length.
+    # Sin TCP_NODELAY, headers y cuerpo en envíos separados esperan el ACK retrasado del cliente (~40 ms)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def do_HEAD(self):
+        self.route("HEAD")
+
+    def route(self, method):
+        state = self.server.state
+        if state.latency:
+            time.sleep(state.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        api = url.path.strip("/").split("/")[0]
+        if api == "_stats":
+            return self.reply(200, self.server.stats(), count=False)
+        state.record(api, "bytes_in", len(body))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        if api == "notion":
+            self.handle_notion(method, url.path, json.loads(body or b"{}"))
+        elif api == "woo":
+            self.handle_woo(query)
+        elif api == "eloqua":
+            self.handle_eloqua(method, url.path, json.loads(body or b"{}"))
+        elif api == "images":
+            self.handle_images(method, url.path)
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def reply(self, status, data, extra_headers=None, count=True):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        if not count:
+            return
+        api = urlparse(self.path).path.strip("/").split("/")[0]
+        self.server.state.record(api, "requests", 1)
+        self.server.state.record(api, "bytes_out", len(body))
+
+    def handle_notion(self, method, path, payload):
+        workload = self.server.state.workload
+        parts = path.strip("/").split("/")[2:]
+        if parts[:1] == ["pages"] and len(parts) == 2:
+            page = workload.pages.get(parts[1])
+            return self.reply(200, page) if page else self.reply(404, {"object": "error", "status": 404})
+        if parts[:1] == ["databases"] and len(parts) == 2:
+            return self.reply(200, {"object": "database", "id": parts[1], "properties": {
+                "Unidad de servicio": {"id": "unds", "type": "select"},
+                "Productos": {"id": "prod", "type": "relation"},
+            }})
+        if parts[:1] == ["databases"] and parts[2:] == ["query"] and method == "POST":
+            source = workload.entries if parts[1] == FORMS_DATABASE_ID else list(workload.pages.values())
+            start = int(payload.get("start_cursor") or 0)
+            size = min(int(payload.get("page_size", 100)), 100)
+            results = source[start:start + size]
+            has_more = start + size < len(source)
+            return self.reply(200, {
+                "object": "list",
+                "results": results,
+                "has_more": has_more,
+                "next_cursor": str(start + size) if has_more else None,
+            })
+        self.reply(404, {"object": "error", "status": 404})
+
+    def handle_woo(self, query):
+        workload = self.server.state.workload
+        # En modo delta no hay cambios simulados desde el último snapshot
+        if "modified_after" in query:
+            source = []
+        elif query.get("status", ["any"])[0] == "publish":
+            source = workload.published_products
+        else:
+            source = workload.products
+        per_page = min(int(query.get("per_page", ["10"])[0]), 100)
+        page = int(query.get("page", ["1"])[0])
+        total_pages = max((len(source) + per_page - 1) // per_page, 1)
+        products = source[(page - 1) * per_page:page * per_page]
+        if "_fields" in query:
+            fields = query["_fields"][0].split(",")
+            products = [{field: product[field] for field in fields if field in product} for product in products]
+        host = f"http://{self.headers['Host']}"
+        products = [
+            {**product, "images": [{**image, "src": host + image["src"]} for image in product["images"]]}
+            if "images" in product else product
+            for product in products
+        ]
+        self.reply(200, products, {
+            "X-WP-Total": str(len(source)),
+            "X-WP-TotalPages": str(total_pages),
+        })
+
+    def handle_eloqua(self, method, path, payload):
+        state = self.server.state
+        parts = path.strip("/").split("/")[1:]
+        if method == "GET" and parts[:2] == ["assets", "emails"]:
+            return self.reply(200, {"elements": [], "page": 1, "pageSize": 1, "total": len(state.emails)})
+        if method == "POST" and parts == ["assets", "email"]:
+            with state.lock:
+                asset_id = str(len(state.emails) + 1)
+                state.emails[asset_id] = payload
+            return self.reply(201, {"type": "Email", "id": asset_id, "name": payload.get("name")})
+        if method == "PUT" and parts[:2] == ["assets", "email"] and len(parts) == 3:
+            if parts[2] not in state.emails:
+                return self.reply(404, [{"type": "ObjectNotFound"}])
+            state.emails[parts[2]] = payload
+            return self.reply(200, {"type": "Email", "id": parts[2], "name": payload.get("name")})
+        self.reply(404, [{"type": "ObjectNotFound"}])
+
+
+    def handle_images(self, method, path):
+        # Una de cada diez imágenes no existe, para ejercitar la imagen genérica
+        number = int("".join(char for char in path if char.isdigit()) or 0)
+        if number % 10 == 0:
+            return self.reply(404, {"error": "not found"})
+        body = b"\x89PNG\r\n\x1a\n" + bytes(24 * 1024)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(body)
+        self.server.state.record("images", "requests", 1)
+        self.server.state.record("images", "bytes_out", len(body) if method != "HEAD" else 0)
+
+
+class FakeApiState:
+    def __init__(self, workload, latency):
+        self.workload = workload
+        self.latency = latency
+        self.emails = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, api, metric, value):
+        with self.lock:
+            self.stats[(api, metric)] += value
+
+
+class FakeApiHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def stats(self):
+        with self.state.lock:
+            stats = dict(self.state.stats)
+        return {
+            api: {metric: stats.get((api, metric), 0) for metric in ("requests", "bytes_in", "bytes_out")}
+            for api in ("notion", "woo", "eloqua", "images")
+        }
+
+
+class FakeApiServer:
+    def __init__(self, workload, latency_ms=0, host="127.0.0.1", port=0):
+        self.httpd = FakeApiHTTPServer((host, port), FakeApiHandler)
+        self.httpd.state = FakeApiState(workload, latency_ms / 1000)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def emails(self):
+        return self.httpd.state.emails
+
+    def stats(self):
+        return self.httpd.stats()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def serve_forever(units, entries, products, latency_ms, ready):
+    server = FakeApiServer(SyntheticWorkload(units, entries=entries, products=products), latency_ms)
+    ready.put(server.base_url)
+    server.httpd.serve_forever()
+
+
+class FakeApiProcess:
+    # Mismos servidores en un proceso aparte, para no mezclar su CPU y memoria con las del script
+    def __init__(self, units, entries=5000, products=50000, latency_ms=0):
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve_forever, args=(units, entries, products, latency_ms, ready), daemon=True)
+        self.process.start()
+        self.base_url = ready.get()
+
+    def stats(self):
+        with urlopen(f"{self.base_url}/_stats") as response:
+            return json.load(response)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
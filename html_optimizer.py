@@ -0,0 +1,102 @@
+import re
+from collections import Counter
+
+# Comentarios condicionales de Outlook: se conservan tal cual, con su contenido
+CONDITIONAL_COMMENT_PATTERN = re.compile(
+    r"<!--\[if[^\]]*\]><!--(?: --)?>"           # apertura de un bloque visible fuera de Outlook
+    r"|<!--\[if[^\]]*\]>.*?<!\[endif\]-->"      # bloque solo para Outlook
+    r"|<!--<!\[endif\]-->"                      # cierre de un bloque visible fuera de Outlook
+    r"|<(pre|textarea|script)\b.*?</\1>",
+    re.DOTALL | re.IGNORECASE,
+)
+STYLE_BLOCK_PATTERN = re.compile(r"<style\b[^>]*>.*?</style>", re.DOTALL | re.IGNORECASE)
+COMMENT_PATTERN = re.compile(r"<!--.*?-->", re.DOTALL)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# Alrededor de etiquetas de bloque el espacio no se ve; entre etiquetas en línea sí y se deja uno
+BLOCK_TAG_SPACE_PATTERN = re.compile(
+    r"\s*(</?(?:html|head|body|meta|link|title|style|table|thead|tbody|tfoot|tr|td|th|div|p|center|br|hr"
+    r"|h[1-6]|ul|ol|li)\b[^>]*>|\x00\d+\x00)\s*",
+    re.IGNORECASE,
+)
+STYLE_ATTR_PATTERN = re.compile(r'\sstyle="([^"]*)"', re.IGNORECASE)
+CLASS_ATTR_PATTERN = re.compile(r'\sclass="([^"]*)"', re.IGNORECASE)
+OPEN_TAG_PATTERN = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)\b[^>]*>")
+DECLARATION_SPACE_PATTERN = re.compile(r"\s*([;:])\s*")
+PLACEHOLDER_PATTERN = re.compile(r"\x00(\d+)\x00")
+# Outlook solo respeta estas declaraciones en línea (y url() puede contener ";"); esos estilos no se mueven
+OUTLOOK_ONLY_PATTERN = re.compile(r"mso-|Margin|url\(")
+
+FACTORED_CLASS_PREFIX = "ds"
+
+
+def compact_style(value):
+    # "display: block;  color: red;" -> "display:block;color:red"
+    return DECLARATION_SPACE_PATTERN.sub(r"\1", value.strip()).strip(";")
+
+
+def important(declarations):
+    # Una regla de clase pierde contra el estilo en línea que reemplaza; !important le devuelve la prioridad
+    return ";".join(
+        declaration if "!important" in declaration else f"{declaration}!important"
+        for declaration in declarations.split(";") if declaration
+    )
+
+
+def factor_inline_styles(html, min_count=3, min_length=40):
+    # Los estilos en línea repetidos pasan a una clase; devuelve el HTML y las reglas CSS nuevas
+    counts = Counter(match.group(1) for match in STYLE_ATTR_PATTERN.finditer(html))
+    repeated = sorted(
+        value for value, count in counts.items()
+        if count >= min_count and len(value) >= min_length and not OUTLOOK_ONLY_PATTERN.search(value)
+    )
+    if not repeated:
+        return html, ""
+    class_names = {value: f"{FACTORED_CLASS_PREFIX}{i}" for i, value in enumerate(repeated)}
+
+    def replace_tag(match):
+        tag = match.group(0)
+        style = STYLE_ATTR_PATTERN.search(tag)
+        if not style or style.group(1) not in class_names:
+            return tag
+        class_name = class_names[style.group(1)]
+        tag = tag[:style.start()] + tag[style.end():]
+        existing = CLASS_ATTR_PATTERN.search(tag)
+        if existing:
+            return f'{tag[:existing.start(1)]}{existing.group(1)} {class_name}{tag[existing.end(1):]}'
+        name_end = len(match.group(1)) + 1
+        return f'{tag[:name_end]} class="{class_name}"{tag[name_end:]}'
+
+    rules = "".join(f".{name}{{{important(value)}}}" for value, name in class_names.items())
+    return OPEN_TAG_PATTERN.sub(replace_tag, html), rules
+
+
+def optimize_html(html, factor_styles=False):
+    protected = []
+
+    def stash(text):
+        protected.append(text)
+        return f"\x00{len(protected) - 1}\x00"
+
+    html = CONDITIONAL_COMMENT_PATTERN.sub(lambda match: stash(match.group(0)), html)
+    # Dentro de <style> (incluido @media) solo se colapsan espacios; el CSS queda igual
+    html = STYLE_BLOCK_PATTERN.sub(lambda match: stash(WHITESPACE_PATTERN.sub(" ", match.group(0))), html)
+    html = COMMENT_PATTERN.sub("", html)
+    html = WHITESPACE_PATTERN.sub(" ", html)
+    html = BLOCK_TAG_SPACE_PATTERN.sub(r"\1", html)
+    html = STYLE_ATTR_PATTERN.sub(lambda match: f' style="{compact_style(match.group(1))}"', html)
+
+    if factor_styles:
+        head_end = html.lower().find("</head>")
+        # Las reglas van al inicio del primer <style> del <head>, para que los @media posteriores sigan ganando
+        head_style = next(
+            (int(match.group(1)) for match in PLACEHOLDER_PATTERN.finditer(html, 0, max(head_end, 0))
+             if protected[int(match.group(1))].lower().startswith("<style")),
+            None,
+        )
+        if head_style is not None:
+            html, rules = factor_inline_styles(html)
+            block = protected[head_style]
+            open_end = block.index(">") + 1
+            protected[head_style] = block[:open_end] + rules + block[open_end:]
+
+    return PLACEHOLDER_PATTERN.sub(lambda match: protected[int(match.group(1))], html)
@@ -0,0 +1,122 @@
+import threading, time, random, logging, gzip, json
+import requests
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    # Limita las peticiones por segundo compartidas entre hilos
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def get_retry_delay(response, attempt, base_delay=1.0, max_delay=60.0):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+    # Backoff exponencial con jitter completo
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def request_with_retry(method, url, limiter=None, max_retries=5, retry_statuses=RETRY_STATUSES,
+                       api="other", session=None, idempotent=True, **kwargs):
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = (session or requests).request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.record_request(api, time.perf_counter() - start)
+            # Los timeouts también se reintentan, salvo un ReadTimeout de una petición no idempotente:
+            # la petición ya se envió y repetirla puede duplicarla (p. ej. crear dos assets en Eloqua)
+            sent = isinstance(e, requests.Timeout) and not isinstance(e, requests.ConnectTimeout)
+            if attempt == max_retries or (sent and not idempotent):
+                raise
+            response, reason = None, type(e).__name__
+        else:
+            body = response.request.body
+            metrics.record_request(
+                api,
+                time.perf_counter() - start,
+                response.status_code,
+                bytes_sent=len(body) if body else 0,
+                bytes_received=len(response.content),
+            )
+            if response.status_code not in retry_statuses or attempt == max_retries:
+                return response
+            reason = response.status_code
+        delay = get_retry_delay(response, attempt)
+        logger.warning("⏳ %s recibido de %s, reintentando en %.1fs...", reason, url, delay,
+                       extra={"api": api, "attempt": attempt + 1})
+        time.sleep(delay)
+
+
+# (conexión, lectura) en segundos; sin timeout una conexión colgada bloquea un hilo para siempre
+DEFAULT_TIMEOUT = (5.0, 30.0)
+
+
+class ApiClient:
+    # Una sesión keep-alive por API: headers, auth y pool de conexiones se arman una sola vez
+    def __init__(self, api, base_url="", headers=None, auth=None, pool_size=10, timeout=DEFAULT_TIMEOUT, hosts=1):
+        self.api = api
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers or {})
+        self.session.auth = auth
+
+    def url(self, path):
+        if "://" in path:
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}" if path else self.base_url
+
+    def request(self, method, path="", limiter=None, compress=False, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if compress and "json" in kwargs:
+            # Solo para endpoints que aceptan Content-Encoding: gzip en la petición
+            kwargs["data"] = gzip.compress(json.dumps(kwargs.pop("json")).encode("utf-8"), compresslevel=6)
+            kwargs["headers"] = {**kwargs.get("headers", {}), "Content-Encoding": "gzip",
+                                 "Content-Type": "application/json"}
+        return request_with_retry(method, self.url(path), limiter=limiter, api=self.api, session=self.session, **kwargs)
+
+    def get(self, path="", **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def head(self, path="", **kwargs):
+        return self.request("HEAD", path, **kwargs)
+
+    def post(self, path="", **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path="", **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,56 @@
+import sqlite3, threading, time
+
+
+class ImageCheckCache:
+    # Resultado persistente de la validación de cada URL de imagen; vence a los ttl_seconds
+    def __init__(self, path, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                ok INTEGER,
+                checked_at REAL
+            )"""
+        )
+        self.conn.commit()
+
+    def get(self, url):
+        with self.lock:
+            row = self.conn.execute("SELECT ok, checked_at FROM images WHERE url = ?", (url,)).fetchone()
+            if row is None or time.time() - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return bool(row[0])
+
+    def put(self, url, ok):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", (url, int(ok), time.time()))
+
+    def purge(self):
+        # Las URLs vencidas se vuelven a validar igual; no tiene sentido conservarlas
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM images WHERE checked_at < ?", (time.time() - self.ttl_seconds,))
+            self.conn.commit()
+        return cursor.rowcount
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
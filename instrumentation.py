@@ -0,0 +1,188 @@
+import json, logging, os, threading, time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Atributos estándar de LogRecord; todo lo demás llega por extra= y se emite como campo
+RESERVED_LOG_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_LOG_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(level="INFO", log_format="text"):
+    handler = logging.StreamHandler()
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    # urllib3 registra cada conexión en DEBUG; solo interesa con --log-level DEBUG explícito
+    logging.getLogger("urllib3").setLevel(max(root.level, logging.INFO))
+
+
+def cumulative_buckets(buckets):
+    # Conteos acumulados al estilo Prometheus: le_X = peticiones con latencia <= X
+    histogram = {}
+    total = 0
+    for bound, count in zip(LATENCY_BUCKETS + ("inf",), buckets):
+        total += count
+        histogram[f"le_{bound}"] = total
+    return histogram
+
+
+class RunMetrics:
+    # Duración por etapa, peticiones/latencia/bytes por API y conteo de elementos procesados
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = {}
+        self.items = defaultdict(int)
+        self.requests = defaultdict(lambda: {
+            "count": 0,
+            "errors": 0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+            "latency_sum": 0.0,
+            "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+            "status": defaultdict(int),
+        })
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            logging.getLogger(__name__).info("Etapa %s: %.2fs", name, elapsed,
+                                             extra={"stage": name, "duration_s": round(elapsed, 3)})
+
+    def add_items(self, name, count=1):
+        with self.lock:
+            self.items[name] += count
+
+    def record_request(self, api, latency, status_code=None, bytes_sent=0, bytes_received=0):
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            stats = self.requests[api]
+            stats["count"] += 1
+            stats["latency_sum"] += latency
+            stats["buckets"][bucket] += 1
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            if status_code is None or status_code >= 400:
+                stats["errors"] += 1
+            stats["status"][str(status_code)] += 1
+
+    def reset(self):
+        self.__init__()
+
+    def snapshot(self):
+        # Estado crudo y serializable, para combinar métricas de procesos hijos
+        with self.lock:
+            return {
+                "stages": dict(self.stages),
+                "items": dict(self.items),
+                "requests": {
+                    api: {**stats, "buckets": list(stats["buckets"]), "status": dict(stats["status"])}
+                    for api, stats in self.requests.items()
+                },
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, count in snapshot["items"].items():
+                self.items[name] += count
+            for api, other in snapshot["requests"].items():
+                stats = self.requests[api]
+                for key in ("count", "errors", "bytes_sent", "bytes_received", "latency_sum"):
+                    stats[key] += other[key]
+                stats["buckets"] = [a + b for a, b in zip(stats["buckets"], other["buckets"])]
+                for status, count in other["status"].items():
+                    stats["status"][status] += count
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                "duration_s": round(time.time() - self.started_at, 3),
+                "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                "items": dict(self.items),
+                "http": {
+                    api: {
+                        "count": stats["count"],
+                        "errors": stats["errors"],
+                        "bytes_sent": stats["bytes_sent"],
+                        "bytes_received": stats["bytes_received"],
+                        "latency_avg_s": round(stats["latency_sum"] / stats["count"], 4) if stats["count"] else 0.0,
+                        "latency_histogram": cumulative_buckets(stats["buckets"]),
+                        "status": dict(stats["status"]),
+                    }
+                    for api, stats in self.requests.items()
+                },
+            }
+
+    def write_json_report(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def write_prometheus_textfile(self, path):
+        report = self.to_dict()
+        lines = [
+            "# HELP emails_run_duration_seconds Duración total de la ejecución.",
+            "# TYPE emails_run_duration_seconds gauge",
+            f"emails_run_duration_seconds {report['duration_s']}",
+            "# HELP emails_stage_duration_seconds Duración por etapa.",
+            "# TYPE emails_stage_duration_seconds gauge",
+        ]
+        lines += [f'emails_stage_duration_seconds{{stage="{name}"}} {seconds}' for name, seconds in report["stages"].items()]
+        lines += ["# HELP emails_items_total Elementos procesados por tipo.", "# TYPE emails_items_total gauge"]
+        lines += [f'emails_items_total{{item="{name}"}} {count}' for name, count in report["items"].items()]
+        lines += [
+            "# HELP emails_http_request_duration_seconds Latencia de peticiones HTTP por API.",
+            "# TYPE emails_http_request_duration_seconds histogram",
+        ]
+        with self.lock:
+            for api, stats in self.requests.items():
+                for key, count in cumulative_buckets(stats["buckets"]).items():
+                    bound = "+Inf" if key == "le_inf" else key[3:]
+                    lines.append(f'emails_http_request_duration_seconds_bucket{{api="{api}",le="{bound}"}} {count}')
+                lines.append(f'emails_http_request_duration_seconds_sum{{api="{api}"}} {round(stats["latency_sum"], 4)}')
+                lines.append(f'emails_http_request_duration_seconds_count{{api="{api}"}} {stats["count"]}')
+            lines += ["# HELP emails_http_errors_total Peticiones HTTP fallidas por API.", "# TYPE emails_http_errors_total counter"]
+            lines += [f'emails_http_errors_total{{api="{api}"}} {stats["errors"]}' for api, stats in self.requests.items()]
+            lines += ["# HELP emails_http_bytes_total Bytes transferidos por API.", "# TYPE emails_http_bytes_total counter"]
+            for api, stats in self.requests.items():
+                lines.append(f'emails_http_bytes_total{{api="{api}",direction="sent"}} {stats["bytes_sent"]}')
+                lines.append(f'emails_http_bytes_total{{api="{api}",direction="received"}} {stats["bytes_received"]}')
+
+        # Escritura atómica para que node_exporter nunca lea un archivo a medias
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+metrics = RunMetrics()
@@ -0,0 +1,60 @@
+import re, unicodedata
+from functools import lru_cache
+
+# Patrones compilados una sola vez para todo el proceso
+UNIT_PREFIX_PATTERN = re.compile(r"^[^-]*-\s*")
+PARENTHESES_PATTERN = re.compile(r"\s*\(.*?\)\s*")
+BRAND_PATTERN = re.compile(r"CHRISTUS MUGUERZA", re.IGNORECASE)
+REPEATED_SPACES_PATTERN = re.compile(r"\s{2,}")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def strip_unit_prefix(title):
+    # "CMSUR - Check up" -> "Check up"
+    return UNIT_PREFIX_PATTERN.sub("", title)
+
+
+def build_alias_pattern(hospital_name):
+    aliases = {
+        hospital_name,
+        hospital_name.replace("H. ", "Hospital "),
+        hospital_name.replace("C. ", "Clínica "),
+    }
+    # Los alias más largos primero para que la alternancia no corte un alias a la mitad
+    alternation = "|".join(re.escape(alias) for alias in sorted(aliases, key=len, reverse=True))
+    return re.compile(alternation, re.IGNORECASE)
+
+
+@lru_cache(maxsize=16384)
+def match_key(name):
+    # Clave canónica para comparar nombres de Notion y WooCommerce: sin acentos, sin mayúsculas y espacios simples
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return WHITESPACE_PATTERN.sub(" ", without_accents.casefold()).strip()
+
+
+class NameNormalizer:
+    def __init__(self, hospital_names=(), cache_size=8192):
+        self.alias_patterns = {name: build_alias_pattern(name) for name in hospital_names}
+        self.clean = lru_cache(maxsize=cache_size)(self.clean_uncached)
+
+    def alias_pattern(self, hospital_name):
+        pattern = self.alias_patterns.get(hospital_name)
+        if pattern is None:
+            pattern = self.alias_patterns[hospital_name] = build_alias_pattern(hospital_name)
+        return pattern
+
+    def clean_uncached(self, name, hospital_name=None):
+        cleaned = UNIT_PREFIX_PATTERN.sub("", name)
+        cleaned = PARENTHESES_PATTERN.sub(" ", cleaned)
+        cleaned = BRAND_PATTERN.sub("", cleaned)
+        if hospital_name:
+            cleaned = self.alias_pattern(hospital_name).sub("", cleaned)
+        return REPEATED_SPACES_PATTERN.sub(" ", cleaned).strip()
+
+    def clean_batch(self, names, hospital_name=None):
+        clean = self.clean
+        return [clean(name, hospital_name) for name in names]
+
+    def cache_info(self):
+        return self.clean.cache_info()
@@ -0,0 +1,81 @@
+import sqlite3, threading, time
+
+
+class NotionPageCache:
+    # Cache persistente de (título, unidad) por página de producto de Notion
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                page_id TEXT PRIMARY KEY,
+                title TEXT,
+                unidad TEXT,
+                last_edited_time TEXT,
+                fetched_at REAL,
+                accessed_at REAL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        self.conn.commit()
+
+    def get(self, page_id):
+        # Las ediciones se detectan antes, al refrescar con put(); aquí solo vence el TTL
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT title, unidad, fetched_at FROM pages WHERE page_id = ?",
+                (page_id,)
+            ).fetchone()
+            if row is None or now - row[2] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE pages SET accessed_at = ? WHERE page_id = ?", (now, page_id))
+            self.hits += 1
+            return row[0], row[1]
+
+    def put(self, page_id, title, unidad, last_edited_time):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (page_id, title, unidad, last_edited_time, now, now)
+            )
+
+    def newest_edit_time(self):
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(last_edited_time) FROM pages").fetchone()
+        return row[0]
+
+    def evict(self):
+        # LRU: conserva solo las max_entries páginas usadas más recientemente
+        with self.lock:
+            cursor = self.conn.execute(
+                """DELETE FROM pages WHERE page_id IN (
+                    SELECT page_id FROM pages ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+        return cursor.rowcount
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,85 @@
+import sys
+
+# Proyección de las respuestas de Notion y WooCommerce a registros compactos.
+# El JSON crudo se descarta en cuanto llega; solo viven en memoria los campos que usa el pipeline.
+
+# Subir este número invalida el estado local guardado con registros de un formato anterior
+RECORD_VERSION = 2
+
+
+def product_unidad(product):
+    for meta in product.get("meta_data") or ():
+        if meta.get("key") == "unidad":
+            raw_value = meta.get("value")
+            if isinstance(raw_value, list) and raw_value:
+                return sys.intern(str(raw_value[0]))
+            elif raw_value is not None:
+                return sys.intern(str(raw_value))
+    return None
+
+
+def product_image(product):
+    # WooCommerce lista primero la imagen destacada
+    for image in product.get("images") or ():
+        if image.get("src"):
+            return image["src"]
+    return None
+
+
+class NotionEntry:
+    __slots__ = ("id", "created_time", "last_edited_time", "unidad", "product_ids")
+
+    def __init__(self, id, created_time, last_edited_time, unidad, product_ids):
+        self.id = id
+        self.created_time = created_time
+        self.last_edited_time = last_edited_time
+        # Solo hay unas decenas de unidades: todas las entradas comparten la misma cadena
+        self.unidad = sys.intern(unidad) if unidad else None
+        self.product_ids = product_ids
+
+    @classmethod
+    def from_api(cls, page):
+        props = page.get("properties", {})
+        unidad = (props.get("Unidad de servicio", {}).get("select") or {}).get("name")
+        relations = props.get("Productos", {}).get("relation", [])
+        product_ids = tuple(item["id"] for item in relations if item.get("id"))
+        return cls(page["id"], page.get("created_time"), page.get("last_edited_time"), unidad, product_ids)
+
+    @classmethod
+    def from_row(cls, row):
+        id, created_time, last_edited_time, unidad, product_ids = row
+        return cls(id, created_time, last_edited_time, unidad, tuple(product_ids))
+
+    def to_row(self):
+        return [self.id, self.created_time, self.last_edited_time, self.unidad, list(self.product_ids)]
+
+    def __repr__(self):
+        return f"NotionEntry({self.id!r}, unidad={self.unidad!r}, productos={len(self.product_ids)})"
+
+
+class WooProduct:
+    __slots__ = ("id", "name", "slug", "price", "on_sale", "unidad_id", "image")
+
+    def __init__(self, id, name, slug, price, on_sale, unidad_id, image=None):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.price = price
+        self.on_sale = on_sale
+        self.unidad_id = unidad_id
+        self.image = image
+
+    @classmethod
+    def from_api(cls, product):
+        return cls(product["id"], product.get("name"), product.get("slug"), product.get("price", ""),
+                   product.get("on_sale", False), product_unidad(product), product_image(product))
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def to_row(self):
+        return [self.id, self.name, self.slug, self.price, self.on_sale, self.unidad_id, self.image]
+
+    def __repr__(self):
+        return f"WooProduct({self.id!r}, {self.name!r}, unidad_id={self.unidad_id!r})"
@@ -0,0 +1,63 @@
+import heapq, math
+
+# Los k productos de cada correo se eligen por puntaje, no por el orden en que llegan de WooCommerce
+
+
+def parse_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def score_on_sale_requests(product):
+    # En oferta primero, luego los más pedidos en los formularios de Notion
+    return product["on_sale"], product.get("requests", 0)
+
+
+def score_on_sale_price(product):
+    # En oferta primero, luego los más baratos; sin precio al final
+    price = parse_price(product["price"])
+    return product["on_sale"], -(price if price is not None else math.inf)
+
+
+def score_requests(product):
+    return product.get("requests", 0), product["on_sale"]
+
+
+SCORERS = {
+    "on_sale_requests": score_on_sale_requests,
+    "on_sale_price": score_on_sale_price,
+    "requests": score_requests,
+}
+
+
+class TopKSelector:
+    # Un heap de a lo sumo k productos por unidad; la raíz es el peor de los elegidos
+    def __init__(self, k, score=score_on_sale_requests):
+        self.k = k
+        self.score = score
+        self.heaps = {}
+        self.offered = 0
+
+    def rank(self, product):
+        # Desempate estable: a igual puntaje gana el ID de producto menor
+        return self.score(product), -product["id"]
+
+    def add(self, unidad_id, product):
+        self.offered += 1
+        heap = self.heaps.setdefault(unidad_id, [])
+        # Un mismo producto puede repetirse si el catálogo cambia durante la paginación
+        if any(selected["id"] == product["id"] for _, selected in heap):
+            return
+        entry = (self.rank(product), product)
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry[0] > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+    def selected(self, unidad_id):
+        return [product for _, product in sorted(self.heaps.get(unidad_id, ()), key=lambda entry: entry[0], reverse=True)]
+
+    def results(self):
+        return {unidad_id: self.selected(unidad_id) for unidad_id in self.heaps}
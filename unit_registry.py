@@ -0,0 +1,82 @@
+import json, os, zlib
+
+UNITS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "units.json")
+
+
+class Unit:
+    # Todo lo que el cruce y el render necesitan de una unidad, calculado una sola vez al cargarla
+    __slots__ = ("hospital", "unidad_id", "url_id", "siglas", "url_suffix", "hombre_images", "mujer_images",
+                 "all_images")
+
+    def __init__(self, hospital, unidad_id, url_id, siglas, utm, fallback_images):
+        self.hospital = hospital
+        self.unidad_id = unidad_id
+        self.url_id = url_id
+        self.siglas = siglas
+        params = [f"select_unidad={url_id}"]
+        params += [f"{key}={value.format(siglas=siglas.lower())}" for key, value in utm.items()]
+        self.url_suffix = "/?" + "&".join(params)
+        self.hombre_images = tuple(fallback_images.get("hombre", ()))
+        self.mujer_images = tuple(fallback_images.get("mujer", ()))
+        self.all_images = self.hombre_images + self.mujer_images + tuple(fallback_images.get("general", ()))
+
+    def fallback_image(self, product_name):
+        name_lower = product_name.lower()
+        if "hombre" in name_lower and self.hombre_images:
+            images = self.hombre_images
+        elif "mujer" in name_lower and self.mujer_images:
+            images = self.mujer_images
+        else:
+            images = self.all_images
+        # Siempre la misma imagen para el mismo producto: así el hash de contenido no cambia entre ejecuciones
+        return images[zlib.crc32(product_name.encode("utf-8")) % len(images)]
+
+
+class UnitRegistry:
+    def __init__(self, product_base_url, utm, fallback_images):
+        self.product_base_url = product_base_url
+        self.utm = utm
+        self.fallback_images = fallback_images
+        self.by_id = {}
+        self.by_hospital = {}
+
+    @classmethod
+    def load(cls, path=UNITS_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        registry = cls(config["product_base_url"], config.get("utm", {}), config["fallback_images"])
+        for unit in config["units"]:
+            registry.add(unit["hospital"], unit["unidad_id"], unit["url_id"], unit["siglas"],
+                         unit.get("fallback_images"))
+        return registry
+
+    def add(self, hospital, unidad_id, url_id, siglas, fallback_images=None):
+        # Una unidad puede reemplazar alguno de los grupos de imágenes genéricas
+        images = {**self.fallback_images, **(fallback_images or {})}
+        unit = Unit(hospital, unidad_id, url_id, siglas, self.utm, images)
+        self.by_id[unidad_id] = unit
+        self.by_hospital[hospital] = unit
+        return unit
+
+    def get(self, unidad_id):
+        return self.by_id.get(unidad_id)
+
+    def by_name(self, hospital):
+        return self.by_hospital.get(hospital)
+
+    def hospital_names(self):
+        return list(self.by_hospital)
+
+    def product_url(self, slug, unit=None):
+        if unit is None:
+            return f"{self.product_base_url}{slug}/"
+        return f"{self.product_base_url}{slug}{unit.url_suffix}"
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, unidad_id):
+        return unidad_id in self.by_id